@@ -45,7 +45,7 @@ class Execute( object ):
 		handler.setLevel( logging_level )
 		self.logger.addHandler( handler )
 	
-	def execute( self, corpus_format, corpus_path, tokenization, model_library, model_path, data_path, num_topics, number_of_seriated_terms ):
+	def execute( self, corpus_format, corpus_path, tokenization, model_library, model_path, data_path, num_topics, number_of_seriated_terms, streaming = False, workers = None, number_of_candidate_terms = None, include_terms = None, number_of_neighbors = None, minimum_g2 = None, mallet_import = None, mallet_beta = None, mallet_export_dense = False, seriation_checkpoint_interval = None, seriation_progress_interval = None, seriation_metrics_file = None ):
 		
 		assert corpus_format is not None
 		assert corpus_path is not None
@@ -60,14 +60,23 @@ class Execute( object ):
 		self.logger.info( '--------------------------------------------------------------------------------' )
 		self.logger.info( 'Tokenizing source corpus...'                                                      )
 		self.logger.info( '    corpus_path = %s (%s)', corpus_path, corpus_format                            )
+		self.logger.info( '    streaming = %s', streaming                                                    )
+		self.logger.info( '    workers = %s', workers                                                        )
 		self.logger.info( '    model_path = %s (%s)', model_path, model_library                              )
 		self.logger.info( '    data_path = %s', data_path                                                    )
 		self.logger.info( '    num_topics = %d', num_topics                                                  )
 		self.logger.info( '    number_of_seriated_terms = %s', number_of_seriated_terms                      )
+		self.logger.info( '    number_of_candidate_terms = %s', number_of_candidate_terms                    )
+		self.logger.info( '    include_terms = %s', include_terms                                            )
+		self.logger.info( '    number_of_neighbors = %s', number_of_neighbors                                )
+		self.logger.info( '    minimum_g2 = %s', minimum_g2                                                  )
+		self.logger.info( '    seriation_checkpoint_interval = %s', seriation_checkpoint_interval            )
+		self.logger.info( '    seriation_progress_interval = %s', seriation_progress_interval                )
+		self.logger.info( '    seriation_metrics_file = %s', seriation_metrics_file                          )
 		self.logger.info( '--------------------------------------------------------------------------------' )
 		self.logger.info( 'Current time = {}'.format( time.ctime() ) )
 		
-		Tokenize( self.logger.level ).execute( corpus_format, corpus_path, data_path, tokenization )
+		Tokenize( self.logger.level ).execute( corpus_format, corpus_path, data_path, tokenization, streaming, workers )
 		self.logger.info( 'Current time = {}'.format( time.ctime() ) )
 		
 		if model_library == 'stmt':
@@ -77,16 +86,16 @@ class Execute( object ):
 		if model_library == 'mallet':
 			command = 'pipeline/train_mallet.sh {} {} {}'.format( data_path + '/tokens/tokens.txt', model_path, num_topics )
 			os.system( command )
-			ImportMallet( self.logger.level ).execute( model_library, model_path, data_path )
+			ImportMallet( self.logger.level ).execute( model_library, model_path, data_path, mallet_import, mallet_beta, mallet_export_dense )
 		self.logger.info( 'Current time = {}'.format( time.ctime() ) )
 		
 		ComputeSaliency( self.logger.level ).execute( data_path )
 		self.logger.info( 'Current time = {}'.format( time.ctime() ) )
 
-		ComputeSimilarity( self.logger.level ).execute( data_path )
+		ComputeSimilarity( self.logger.level ).execute( data_path, number_of_candidate_terms = number_of_candidate_terms, include_terms = include_terms, workers = workers, number_of_neighbors = number_of_neighbors, minimum_g2 = minimum_g2 )
 		self.logger.info( 'Current time = {}'.format( time.ctime() ) )
 
-		ComputeSeriation( self.logger.level ).execute( data_path, number_of_seriated_terms )
+		ComputeSeriation( self.logger.level ).execute( data_path, number_of_seriated_terms, checkpointInterval = seriation_checkpoint_interval, progressInterval = seriation_progress_interval, metricsFile = seriation_metrics_file )
 		self.logger.info( 'Current time = {}'.format( time.ctime() ) )
 
 		PrepareDataForClient( self.logger.level ).execute( data_path )
@@ -103,21 +112,46 @@ def main():
 	parser.add_argument( 'config_file'    , type = str, help = 'Termite configuration file.' )
 	parser.add_argument( '--corpus-format', type = str, dest = 'corpus_format', help = 'Override corpus format in the config file.' )
 	parser.add_argument( '--corpus-path'  , type = str, dest = 'corpus_path'  , help = 'Override corpus path in the config file.' )
+	parser.add_argument( '--streaming'    , action = 'store_true', dest = 'streaming', default = None, help = 'Tokenize the corpus one document at a time.' )
 	parser.add_argument( '--model-library', type = str, dest = 'model_library', help = 'Override model library in the config file.' )
 	parser.add_argument( '--model-path'   , type = str, dest = 'model_path'   , help = 'Override model path in the config file.' )
 	parser.add_argument( '--num-topcis'   , type = int, dest = 'num_topics'   , help = 'Override number of topics in the config file.' )
+	parser.add_argument( '--mallet-import', type = str, dest = 'mallet_import', choices = [ 'weights', 'counts' ], help = 'Override whether to import Mallet topic-word weights or word-topic counts.' )
+	parser.add_argument( '--mallet-beta'  , type = float, dest = 'mallet_beta', help = 'Override the topic-word smoothing added to Mallet word-topic counts.' )
+	parser.add_argument( '--mallet-export-dense', action = 'store_true', dest = 'mallet_export_dense', default = None, help = 'Also write Mallet word-topic counts as a dense text matrix.' )
 	parser.add_argument( '--data-path'    , type = str, dest = 'data_path'    , help = 'Override data path in the config file.' )
 	parser.add_argument( '--number-of-seriated-terms', type = int, dest = 'number_of_seriated_terms', help = 'Override the number of terms to seriate.' )
+	parser.add_argument( '--number-of-candidate-terms', type = int, dest = 'number_of_candidate_terms', help = 'Override the number of salient terms for which to compute similarity.' )
+	parser.add_argument( '--include-terms', type = str, dest = 'include_terms', help = 'Override the file of additional terms for which to compute similarity.' )
+	parser.add_argument( '--number-of-neighbors', type = int, dest = 'number_of_neighbors', help = 'Override the number of most similar terms to keep for each term.' )
+	parser.add_argument( '--minimum-g2'   , type = float, dest = 'minimum_g2' , help = 'Override the minimum similarity score to keep.' )
+	parser.add_argument( '--seriation-checkpoint-interval', type = int, dest = 'seriation_checkpoint_interval', help = 'Override the number of seriation iterations between checkpoints.' )
+	parser.add_argument( '--seriation-progress-interval', type = int, dest = 'seriation_progress_interval', help = 'Override the number of seriation iterations between progress reports.' )
+	parser.add_argument( '--seriation-metrics-file', type = str, dest = 'seriation_metrics_file', help = 'Override the JSON file to write seriation progress metrics to.' )
+	parser.add_argument( '--workers'      , type = int, dest = 'workers'      , help = 'Override number of worker processes in the config file.' )
 	parser.add_argument( '--logging'      , type = int, dest = 'logging'      , help = 'Override logging level specified in config file.' )
 	args = parser.parse_args()
 	
 	corpus_format = None
 	corpus_path = None
+	tokenization = None
+	streaming = False
 	model_library = None
 	model_path = None
 	data_path = None
 	num_topics = None
 	number_of_seriated_terms = None
+	number_of_candidate_terms = None
+	include_terms = None
+	number_of_neighbors = None
+	minimum_g2 = None
+	mallet_import = None
+	mallet_beta = None
+	mallet_export_dense = False
+	seriation_checkpoint_interval = None
+	seriation_progress_interval = None
+	seriation_metrics_file = None
+	workers = None
 	logging_level = 20
 	
 	# Read in default values from the configuration file
@@ -129,16 +163,40 @@ def main():
 		corpus_path = config.get( 'Corpus', 'path' )
 	if config.has_section( 'Corpus' ) and config.has_option( 'Corpus', 'tokenization' ):
 		tokenization = config.get( 'Corpus', 'tokenization' )
+	if config.has_section( 'Corpus' ) and config.has_option( 'Corpus', 'streaming' ):
+		streaming = config.getboolean( 'Corpus', 'streaming' )
 	if config.has_section( 'TopicModel' ) and config.has_option( 'TopicModel', 'library' ):
 		model_library = config.get( 'TopicModel', 'library' )
 	if config.has_section( 'TopicModel' ) and config.has_option( 'TopicModel', 'path' ):
 		model_path = config.get( 'TopicModel', 'path' )
 	if config.has_section( 'TopicModel' ) and config.has_option( 'TopicModel', 'num_topics' ):
 		num_topics = config.getint( 'TopicModel', 'num_topics' )
+	if config.has_section( 'TopicModel' ) and config.has_option( 'TopicModel', 'mallet_import' ):
+		mallet_import = config.get( 'TopicModel', 'mallet_import' )
+	if config.has_section( 'TopicModel' ) and config.has_option( 'TopicModel', 'mallet_beta' ):
+		mallet_beta = config.getfloat( 'TopicModel', 'mallet_beta' )
+	if config.has_section( 'TopicModel' ) and config.has_option( 'TopicModel', 'mallet_export_dense' ):
+		mallet_export_dense = config.getboolean( 'TopicModel', 'mallet_export_dense' )
 	if config.has_section( 'Termite' ) and config.has_option( 'Termite', 'path' ):
 		data_path = config.get( 'Termite', 'path' )
 	if config.has_section( 'Termite' ) and config.has_option( 'Termite', 'number_of_seriated_terms' ):
 		number_of_seriated_terms = config.getint( 'Termite', 'number_of_seriated_terms' )
+	if config.has_section( 'Termite' ) and config.has_option( 'Termite', 'number_of_candidate_terms' ):
+		number_of_candidate_terms = config.getint( 'Termite', 'number_of_candidate_terms' )
+	if config.has_section( 'Termite' ) and config.has_option( 'Termite', 'include_terms' ):
+		include_terms = config.get( 'Termite', 'include_terms' )
+	if config.has_section( 'Termite' ) and config.has_option( 'Termite', 'number_of_neighbors' ):
+		number_of_neighbors = config.getint( 'Termite', 'number_of_neighbors' )
+	if config.has_section( 'Termite' ) and config.has_option( 'Termite', 'minimum_g2' ):
+		minimum_g2 = config.getfloat( 'Termite', 'minimum_g2' )
+	if config.has_section( 'Termite' ) and config.has_option( 'Termite', 'seriation_checkpoint_interval' ):
+		seriation_checkpoint_interval = config.getint( 'Termite', 'seriation_checkpoint_interval' )
+	if config.has_section( 'Termite' ) and config.has_option( 'Termite', 'seriation_progress_interval' ):
+		seriation_progress_interval = config.getint( 'Termite', 'seriation_progress_interval' )
+	if config.has_section( 'Termite' ) and config.has_option( 'Termite', 'seriation_metrics_file' ):
+		seriation_metrics_file = config.get( 'Termite', 'seriation_metrics_file' )
+	if config.has_section( 'Misc' ) and config.has_option( 'Misc', 'workers' ):
+		workers = config.getint( 'Misc', 'workers' )
 	if config.has_section( 'Misc' ) and config.has_option( 'Misc', 'logging' ):
 		logging_level = config.getint( 'Misc', 'logging' )
 	
@@ -147,6 +205,8 @@ def main():
 		corpus_format = args.corpus_format
 	if args.corpus_path is not None:
 		corpus_path = args.corpus_path
+	if args.streaming is not None:
+		streaming = args.streaming
 	if args.model_library is not None:
 		model_library = args.model_library
 	if args.model_path is not None:
@@ -157,10 +217,32 @@ def main():
 		data_path = args.data_path
 	if args.number_of_seriated_terms is not None:
 		number_of_seriated_terms = args.number_of_seriated_terms
+	if args.number_of_candidate_terms is not None:
+		number_of_candidate_terms = args.number_of_candidate_terms
+	if args.include_terms is not None:
+		include_terms = args.include_terms
+	if args.number_of_neighbors is not None:
+		number_of_neighbors = args.number_of_neighbors
+	if args.minimum_g2 is not None:
+		minimum_g2 = args.minimum_g2
+	if args.seriation_checkpoint_interval is not None:
+		seriation_checkpoint_interval = args.seriation_checkpoint_interval
+	if args.seriation_progress_interval is not None:
+		seriation_progress_interval = args.seriation_progress_interval
+	if args.seriation_metrics_file is not None:
+		seriation_metrics_file = args.seriation_metrics_file
+	if args.mallet_import is not None:
+		mallet_import = args.mallet_import
+	if args.mallet_beta is not None:
+		mallet_beta = args.mallet_beta
+	if args.mallet_export_dense is not None:
+		mallet_export_dense = args.mallet_export_dense
+	if args.workers is not None:
+		workers = args.workers
 	if args.logging is not None:
 		logging_level = args.logging
 	
-	Execute( logging_level ).execute( corpus_format, corpus_path, tokenization, model_library, model_path, data_path, num_topics, number_of_seriated_terms )
+	Execute( logging_level ).execute( corpus_format, corpus_path, tokenization, model_library, model_path, data_path, num_topics, number_of_seriated_terms, streaming = streaming, workers = workers, number_of_candidate_terms = number_of_candidate_terms, include_terms = include_terms, number_of_neighbors = number_of_neighbors, minimum_g2 = minimum_g2, mallet_import = mallet_import, mallet_beta = mallet_beta, mallet_export_dense = mallet_export_dense, seriation_checkpoint_interval = seriation_checkpoint_interval, seriation_progress_interval = seriation_progress_interval, seriation_metrics_file = seriation_metrics_file )
 
 if __name__ == '__main__':
 	main()
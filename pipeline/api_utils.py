@@ -1,15 +1,43 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import os
 import re
+import bz2
+import glob
+import gzip
 import json
+import shutil
+from array import array
 from io_utils import CheckAndMakeDirs
-from io_utils import ReadAsList, ReadAsVector, ReadAsMatrix, ReadAsSparseVector, ReadAsSparseMatrix, ReadAsJson
-from io_utils import WriteAsList, WriteAsVector, WriteAsMatrix, WriteAsSparseVector, WriteAsSparseMatrix, WriteAsJson, WriteAsTabDelimited
+from io_utils import ReadAsList, ReadAsVector, ReadAsMatrix, ReadAsSparseVector, ReadAsSparseMatrix, ReadAsBinaryArray, ReadAsJson
+from io_utils import WriteAsList, WriteAsVector, WriteAsMatrix, WriteAsSparseVector, WriteAsSparseMatrix, WriteAsBinaryArray, WriteAsJson, WriteAsTabDelimited
 from utf8_utils import UnicodeReader, UnicodeWriter
 
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+try:
+	import lzma
+except ImportError:
+	try:
+		from backports import lzma
+	except ImportError:
+		lzma = None
+
 class DocumentsAPI( object ):
-	ACCEPTABLE_FORMATS = frozenset( [ 'file' ] )
+	"""
+	Corpus formats:
+	    'file'    A single tab-delimited file, with one document per line: doc_id<tab>document_content
+	    'glob'    A glob pattern matching multiple files in the 'file' format, read in sorted order.
+	    'folder'  A directory, in which every file (including subdirectories) is one document;
+	              the doc_id is the path of the file relative to the directory.
+	Files ending in '.gz', '.bz2', or '.xz' are decompressed on the fly.
+	"""
+	
+	ACCEPTABLE_FORMATS = frozenset( [ 'file', 'glob', 'folder' ] )
 	
 	def __init__( self, format, path ):
 		assert format in DocumentsAPI.ACCEPTABLE_FORMATS
@@ -19,42 +47,430 @@ class DocumentsAPI( object ):
 	
 	def read( self ):
 		self.data = {}
-		filename = self.path
-		with open( filename, 'r' ) as f:
-			lines = f.read().decode( 'utf-8', 'ignore' ).splitlines()
-			for line in lines:
-				docID, docContent = line.split( '\t' )
-				self.data[ docID ] = docContent
+		for docID, docContent in self.iterate():
+			self.data[ docID ] = docContent
+	
+	def getFilenames( self ):
+		if self.format == 'file':
+			return [ self.path ]
+		if self.format == 'glob':
+			return sorted( glob.glob( self.path ) )
+		filenames = []
+		for root, folders, files in os.walk( self.path ):
+			folders.sort()
+			for filename in sorted( files ):
+				filenames.append( os.path.join( root, filename ) )
+		return filenames
+	
+	def isCompressed( self, filename ):
+		return filename.endswith( ( '.gz', '.bz2', '.xz' ) )
+	
+	def openFile( self, filename ):
+		if filename.endswith( '.gz' ):
+			return gzip.open( filename, 'rb' )
+		if filename.endswith( '.bz2' ):
+			return bz2.BZ2File( filename, 'r' )
+		if filename.endswith( '.xz' ):
+			assert lzma is not None, 'Reading .xz files requires the lzma module (backports.lzma)'
+			return lzma.LZMAFile( filename, 'r' )
+		return open( filename, 'r' )
+	
+	def iterate( self, chunk = None ):
+		"""
+		Yield ( docID, docContent ) pairs one document at a time, in corpus order.
+		Only the current document is held in memory.
+		If a chunk from getChunks() is provided, yield only the documents in that chunk.
+		"""
+		if chunk is None:
+			chunk = [ ( filename, None ) for filename in self.getFilenames() ]
+		for ( filename, byteRange ) in chunk:
+			if self.format == 'folder':
+				with self.openFile( filename ) as f:
+					docID = os.path.relpath( filename, self.path ).decode( 'utf-8', 'ignore' )
+					docContent = ' '.join( f.read().decode( 'utf-8', 'ignore' ).replace( '\t', ' ' ).splitlines() )
+					yield docID, docContent
+			else:
+				with self.openFile( filename ) as f:
+					if byteRange is None:
+						rawLines = f
+					else:
+						rawLines = self.iterateRange( f, byteRange )
+					for rawLine in rawLines:
+						for line in rawLine.decode( 'utf-8', 'ignore' ).splitlines():
+							docID, docContent = line.split( '\t' )
+							yield docID, docContent
+	
+	def iterateRange( self, f, byteRange ):
+		start, end = byteRange
+		if start > 0:
+			# Skip the remainder of a line that belongs to the previous chunk
+			f.seek( start - 1 )
+			f.readline()
+		while f.tell() < end:
+			rawLine = f.readline()
+			if not rawLine:
+				break
+			yield rawLine
+	
+	def getChunks( self, count ):
+		"""
+		Split the corpus into roughly count chunks of similar size.
+		A chunk is a list of ( filename, byteRange ) pairs, where byteRange is either
+		None (the entire file) or a ( start, end ) range of an uncompressed file.
+		Every document belongs to exactly one chunk; see iterate().
+		Concatenating the chunks in order preserves corpus order.
+		"""
+		filenames = self.getFilenames()
+		if self.format == 'folder':
+			offsets = [ len( filenames ) * i // count for i in range( count + 1 ) ]
+			return [ [ ( filename, None ) for filename in filenames[start:end] ] for ( start, end ) in zip( offsets[:-1], offsets[1:] ) if start < end ]
+		
+		chunks = []
+		totalSize = max( 1, sum( os.path.getsize( filename ) for filename in filenames ) )
+		for filename in filenames:
+			if self.isCompressed( filename ):
+				chunks.append( [ ( filename, None ) ] )
+			else:
+				size = os.path.getsize( filename )
+				n = max( 1, int( round( float( count ) * size / totalSize ) ) )
+				offsets = [ size * i // n for i in range( n + 1 ) ]
+				chunks.extend( [ [ ( filename, ( start, end ) ) ] for ( start, end ) in zip( offsets[:-1], offsets[1:] ) if start < end ] )
+		return chunks
+
+class TokenEncoder( object ):
+	"""
+	Accumulate documents as a flat stream of integer token IDs.
+	Token IDs are assigned in sorted vocabulary order, so that comparing two IDs
+	gives the same result as comparing the two corresponding terms.
+	"""
+	
+	def __init__( self ):
+		self.termIDs = {}
+		self.terms = []
+		self.document_index = []
+		self.token_ids = array( 'i' )
+		self.document_offsets = [ 0 ]
+	
+	def append( self, docID, docTokens ):
+		self.encodeTokens( docTokens )
+		self.document_index.append( docID )
+		self.document_offsets.append( len( self.token_ids ) )
+	
+	def encodeTokens( self, docTokens ):
+		"""Append the IDs of the tokens of one document, in a single lookup pass. New terms are assigned the next free IDs, in no particular order."""
+		termIDs = self.termIDs
+		for token in set( docTokens ).difference( termIDs ):
+			termIDs[ token ] = len( self.terms )
+			self.terms.append( token )
+		self.token_ids.extend( map( termIDs.__getitem__, docTokens ) )
+	
+	def finalize( self ):
+		"""Return ( vocabulary, document_index, token_ids, document_offsets ), renumbered in sorted vocabulary order."""
+		order = sorted( range( len( self.terms ) ), key = self.terms.__getitem__ )
+		vocabulary = [ self.terms[i] for i in order ]
+		if numpy is not None:
+			remap = numpy.empty( len( order ), dtype = numpy.int32 )
+			remap[ order ] = numpy.arange( len( order ), dtype = numpy.int32 )
+			token_ids = remap[ numpy.frombuffer( self.token_ids, dtype = numpy.int32 ) ]
+			document_offsets = numpy.array( self.document_offsets, dtype = numpy.int64 )
+		else:
+			remap = [ 0 ] * len( order )
+			for newID, oldID in enumerate( order ):
+				remap[ oldID ] = newID
+			token_ids = array( 'i', ( remap[ oldID ] for oldID in self.token_ids ) )
+			document_offsets = self.document_offsets
+		return vocabulary, self.document_index, token_ids, document_offsets
+
+class TokenStreamEncoder( TokenEncoder ):
+	"""
+	Build the integer-encoded token store on disk as documents stream in, holding only the vocabulary
+	and a block of tokens in memory. Token IDs are first appended in order of assignment to a
+	temporary file, then renumbered in sorted vocabulary order one block at a time. Requires numpy.
+	
+	A partial store (for a chunk of the corpus, see TokensAPI.merge) is written to files with the given
+	suffix, and keeps its own vocabulary and token IDs in order of assignment.
+	"""
+	
+	# Number of token IDs to buffer in memory before appending them to disk
+	BLOCK_SIZE = 1 << 20
+	
+	def __init__( self, path, suffix = '' ):
+		TokenEncoder.__init__( self )
+		self.path = path
+		self.suffix = suffix
+		self.flushed_count = 0
+		CheckAndMakeDirs( self.path )
+		if os.path.exists( self.path + TokensAPI.TOKEN_IDS + suffix ):
+			os.remove( self.path + TokensAPI.TOKEN_IDS + suffix )
+		self.tokenFile = open( self.path + TokensAPI.TOKEN_IDS + suffix + '.tmp', 'wb' )
+		self.offsetFile = open( self.path + TokensAPI.DOCUMENT_OFFSETS + suffix, 'wb' )
+		self.indexFile = open( self.path + TokensAPI.DOCUMENT_INDEX + suffix, 'w' )
+	
+	def append( self, docID, docTokens ):
+		self.encodeTokens( docTokens )
+		self.document_index.append( docID )
+		self.document_offsets.append( self.flushed_count + len( self.token_ids ) )
+		if len( self.token_ids ) >= TokenStreamEncoder.BLOCK_SIZE:
+			self.flush()
+	
+	def flush( self ):
+		"""Append the buffered token IDs, document offsets and document IDs to disk."""
+		numpy.array( self.token_ids, dtype = TokensAPI.TOKEN_IDS_DTYPE ).tofile( self.tokenFile )
+		numpy.array( self.document_offsets, dtype = TokensAPI.DOCUMENT_OFFSETS_DTYPE ).tofile( self.offsetFile )
+		for docID in self.document_index:
+			self.indexFile.write( docID.encode( 'utf-8' ) + '\n' )
+		self.flushed_count += len( self.token_ids )
+		self.token_ids = array( 'i' )
+		self.document_offsets = []
+		self.document_index = []
+	
+	def finalize( self, sort = True ):
+		"""
+		Write the vocabulary, and renumber the token IDs on disk in sorted vocabulary order.
+		Without sorting, the vocabulary and token IDs are kept in order of assignment.
+		"""
+		self.flush()
+		self.tokenFile.close()
+		self.offsetFile.close()
+		self.indexFile.close()
+		
+		filename = self.path + TokensAPI.TOKEN_IDS + self.suffix + '.tmp'
+		if not sort:
+			WriteAsList( self.terms, self.path + TokensAPI.VOCABULARY + self.suffix )
+			os.rename( filename, self.path + TokensAPI.TOKEN_IDS + self.suffix )
+			return
+		
+		order = sorted( range( len( self.terms ) ), key = self.terms.__getitem__ )
+		WriteAsList( [ self.terms[i] for i in order ], self.path + TokensAPI.VOCABULARY + self.suffix )
+		remap = numpy.empty( len( order ), dtype = numpy.int32 )
+		remap[ order ] = numpy.arange( len( order ), dtype = numpy.int32 )
+		
+		token_ids = ReadAsBinaryArray( filename, TokensAPI.TOKEN_IDS_DTYPE )
+		with open( self.path + TokensAPI.TOKEN_IDS + self.suffix + '.part', 'wb' ) as f:
+			for start in range( 0, len( token_ids ), TokenStreamEncoder.BLOCK_SIZE ):
+				remap[ token_ids[ start : start + TokenStreamEncoder.BLOCK_SIZE ] ].astype( TokensAPI.TOKEN_IDS_DTYPE ).tofile( f )
+		del token_ids
+		os.remove( filename )
+		os.rename( self.path + TokensAPI.TOKEN_IDS + self.suffix + '.part', self.path + TokensAPI.TOKEN_IDS + self.suffix )
 
 class TokensAPI( object ):
 	SUBFOLDER = 'tokens'
 	TOKENS = 'tokens.txt'
+	VOCABULARY = 'vocabulary.txt'
+	DOCUMENT_INDEX = 'document-index.txt'
+	TOKEN_IDS = 'token-ids.bin'
+	TOKEN_IDS_DTYPE = '<i4'
+	DOCUMENT_OFFSETS = 'document-offsets.bin'
+	DOCUMENT_OFFSETS_DTYPE = '<i8'
 	
 	def __init__( self, path ):
 		self.path = '{}/{}/'.format( path, TokensAPI.SUBFOLDER )
 		self.data = {}
+		self.vocabulary = []
+		self.document_index = []
+		self.token_ids = None
+		self.document_offsets = None
 	
 	def read( self ):
 		self.data = {}
+		for ( docID, docTokens ) in self.iterate():
+			self.data[ docID ] = docTokens
+	
+	def iterate( self ):
 		filename = self.path + TokensAPI.TOKENS
 		with open( filename, 'r' ) as f:
 			lines = UnicodeReader( f )
 			for ( docID, docTokens ) in lines:
-				self.data[ docID ] = docTokens.split( ' ' )
+				if len( docTokens ) > 0:
+					yield docID, docTokens.split( ' ' )
+				else:
+					yield docID, []
 	
-	def write( self ):
+	def write( self, documents = None, part = None ):
+		"""
+		Write tokens to disk.
+		If an iterable of ( docID, docTokens ) pairs is provided, write it out
+		as it is consumed instead of the in-memory data.
+		The integer-encoded token store is streamed to disk alongside the tokens file.
+		If a part index is provided, write a partial tokens file and a partial
+		token store instead, to be combined with merge().
+		"""
+		if documents is None:
+			documents = self.data.iteritems()
+		encoder = None
+		if part is None:
+			filename = self.path + TokensAPI.TOKENS
+			if numpy is not None:
+				encoder = TokenStreamEncoder( self.path )
+		else:
+			filename = self.getPartFilename( part )
+			if numpy is not None:
+				encoder = TokenStreamEncoder( self.path, self.getPartSuffix( part ) )
 		CheckAndMakeDirs( self.path )
-		filename = self.path + TokensAPI.TOKENS
 		with open( filename, 'w' ) as f:
 			writer = UnicodeWriter( f )
-			for ( docID, docTokens ) in self.data.iteritems():
+			for ( docID, docTokens ) in documents:
 				writer.writerow( [ docID, ' '.join(docTokens) ] )
+				if encoder is not None:
+					encoder.append( docID, docTokens )
+		if encoder is not None:
+			encoder.finalize( sort = part is None )
+			if part is None:
+				self.readEncoded()
+	
+	def getPartSuffix( self, index ):
+		return '.part-{:05d}'.format( index )
+	
+	def getPartFilename( self, index ):
+		return self.path + TokensAPI.TOKENS + self.getPartSuffix( index )
+	
+	def merge( self, parts ):
+		"""
+		Concatenate partial token files (in the given order of part indexes) into the tokens file, and delete them.
+		Partial token stores are combined without re-encoding the tokens: their vocabularies are merged,
+		and the token IDs of each part are mapped onto the sorted vocabulary with a single lookup.
+		"""
+		CheckAndMakeDirs( self.path )
+		filename = self.path + TokensAPI.TOKENS
+		with open( filename, 'w' ) as f:
+			for part in parts:
+				partFilename = self.getPartFilename( part )
+				with open( partFilename, 'r' ) as g:
+					shutil.copyfileobj( g, f )
+				os.remove( partFilename )
+		if numpy is not None:
+			self.mergeEncoded( parts )
+			self.readEncoded()
+	
+	def mergeEncoded( self, parts ):
+		suffixes = [ self.getPartSuffix( part ) for part in parts ]
+		if os.path.exists( self.path + TokensAPI.TOKEN_IDS ):
+			os.remove( self.path + TokensAPI.TOKEN_IDS )
+		vocabularies = [ ReadAsList( self.path + TokensAPI.VOCABULARY + suffix ) for suffix in suffixes ]
+		vocabulary = sorted( set().union( *vocabularies ) )
+		termIDs = { term : termID for termID, term in enumerate( vocabulary ) }
+		WriteAsList( vocabulary, self.path + TokensAPI.VOCABULARY )
+		
+		tokenFilename = self.path + TokensAPI.TOKEN_IDS + '.part'
+		with open( tokenFilename, 'wb' ) as f, open( self.path + TokensAPI.DOCUMENT_OFFSETS, 'wb' ) as g, open( self.path + TokensAPI.DOCUMENT_INDEX, 'w' ) as h:
+			numpy.zeros( 1, dtype = TokensAPI.DOCUMENT_OFFSETS_DTYPE ).tofile( g )
+			token_count = 0
+			for suffix, partVocabulary in zip( suffixes, vocabularies ):
+				remap = numpy.array( [ termIDs[ term ] for term in partVocabulary ], dtype = numpy.int32 )
+				token_ids = ReadAsBinaryArray( self.path + TokensAPI.TOKEN_IDS + suffix, TokensAPI.TOKEN_IDS_DTYPE )
+				remap.take( token_ids ).astype( TokensAPI.TOKEN_IDS_DTYPE ).tofile( f )
+				document_offsets = ReadAsBinaryArray( self.path + TokensAPI.DOCUMENT_OFFSETS + suffix, TokensAPI.DOCUMENT_OFFSETS_DTYPE )
+				( document_offsets[1:] + token_count ).astype( TokensAPI.DOCUMENT_OFFSETS_DTYPE ).tofile( g )
+				token_count += len( token_ids )
+				del token_ids, document_offsets
+				with open( self.path + TokensAPI.DOCUMENT_INDEX + suffix, 'r' ) as partFile:
+					shutil.copyfileobj( partFile, h )
+				for name in [ TokensAPI.VOCABULARY, TokensAPI.DOCUMENT_INDEX, TokensAPI.TOKEN_IDS, TokensAPI.DOCUMENT_OFFSETS ]:
+					os.remove( self.path + name + suffix )
+		os.rename( tokenFilename, self.path + TokensAPI.TOKEN_IDS )
+	
+	def encodeToDisk( self, documents ):
+		"""Stream ( docID, docTokens ) pairs into the integer-encoded token store on disk, then memory-map it."""
+		encoder = TokenStreamEncoder( self.path )
+		for ( docID, docTokens ) in documents:
+			encoder.append( docID, docTokens )
+		encoder.finalize()
+		self.readEncoded()
+	
+	def encode( self, documents = None ):
+		"""Build the integer-encoded token store from ( docID, docTokens ) pairs, by default the in-memory data."""
+		if documents is None:
+			documents = self.data.iteritems()
+		encoder = TokenEncoder()
+		for ( docID, docTokens ) in documents:
+			encoder.append( docID, docTokens )
+		self.setEncoded( encoder )
+	
+	def setEncoded( self, encoder ):
+		( self.vocabulary, self.document_index, self.token_ids, self.document_offsets ) = encoder.finalize()
+	
+	def hasEncoded( self ):
+		return numpy is not None and os.path.exists( self.path + TokensAPI.TOKEN_IDS )
+	
+	def readEncoded( self ):
+		"""Memory-map the integer-encoded token store, without copying the token stream."""
+		self.vocabulary = ReadAsList( self.path + TokensAPI.VOCABULARY )
+		self.document_index = ReadAsList( self.path + TokensAPI.DOCUMENT_INDEX )
+		self.token_ids = ReadAsBinaryArray( self.path + TokensAPI.TOKEN_IDS, TokensAPI.TOKEN_IDS_DTYPE )
+		self.document_offsets = ReadAsBinaryArray( self.path + TokensAPI.DOCUMENT_OFFSETS, TokensAPI.DOCUMENT_OFFSETS_DTYPE )
+	
+	def writeEncoded( self ):
+		CheckAndMakeDirs( self.path )
+		WriteAsList( self.vocabulary, self.path + TokensAPI.VOCABULARY )
+		WriteAsList( self.document_index, self.path + TokensAPI.DOCUMENT_INDEX )
+		WriteAsBinaryArray( self.token_ids, self.path + TokensAPI.TOKEN_IDS, TokensAPI.TOKEN_IDS_DTYPE )
+		WriteAsBinaryArray( self.document_offsets, self.path + TokensAPI.DOCUMENT_OFFSETS, TokensAPI.DOCUMENT_OFFSETS_DTYPE )
+	
+	def iterateEncoded( self, start = 0, end = None ):
+		"""Yield ( docID, tokenIDs ) pairs, where tokenIDs is a slice of the token stream; optionally for a range of documents only."""
+		if end is None:
+			end = len( self.document_index )
+		for index in range( start, end ):
+			yield self.document_index[index], self.token_ids[ self.document_offsets[index] : self.document_offsets[index+1] ]
+
+class SmoothedCountMatrix( object ):
+	"""
+	A read-only matrix of sparse counts in compressed sparse row (CSR) form, with a constant smoothing added to every cell.
+	Rows are built on demand as lists of floats; numpy.asarray() builds the entire dense matrix at once.
+	"""
+	
+	def __init__( self, indptr, indices, values, column_count, smoothing ):
+		self.indptr = indptr
+		self.indices = indices
+		self.values = values
+		self.column_count = column_count
+		self.smoothing = smoothing
+	
+	def __len__( self ):
+		return len( self.indptr ) - 1
+	
+	def __getitem__( self, i ):
+		( start, end ) = ( self.indptr[i], self.indptr[i+1] )
+		if numpy is not None:
+			row = numpy.empty( self.column_count, dtype = numpy.float64 )
+			row.fill( self.smoothing )
+			row[ numpy.asarray( self.indices[ start : end ], dtype = numpy.intp ) ] += numpy.asarray( self.values[ start : end ], dtype = numpy.float64 )
+			return row.tolist()
+		row = [ self.smoothing ] * self.column_count
+		for j in range( start, end ):
+			row[ self.indices[j] ] += self.values[j]
+		return row
+	
+	def __iter__( self ):
+		for i in range( len( self ) ):
+			yield self[i]
+	
+	def __array__( self, dtype = None ):
+		matrix = numpy.empty( ( len( self ), self.column_count ), dtype = numpy.float64 )
+		matrix.fill( self.smoothing )
+		rows = numpy.repeat( numpy.arange( len( self ) ), numpy.diff( numpy.asarray( self.indptr ) ) )
+		matrix[ rows, numpy.asarray( self.indices, dtype = numpy.intp ) ] += numpy.asarray( self.values, dtype = numpy.float64 )
+		if dtype is not None:
+			matrix = matrix.astype( dtype, copy = False )
+		return matrix
 
 class ModelAPI( object ):
 	SUBFOLDER = 'model'
 	TOPIC_INDEX = 'topic-index.txt'
 	TERM_INDEX = 'term-index.txt'
 	TERM_TOPIC_MATRIX = 'term-topic-matrix.txt'
+	TERM_TOPIC_MATRIX_CACHE = 'term-topic-matrix.bin'
+	TERM_TOPIC_MATRIX_CACHE_DTYPE = '<f8'
+	TERM_TOPIC_COUNTS_INDPTR = 'term-topic-counts-indptr.bin'
+	TERM_TOPIC_COUNTS_INDPTR_DTYPE = '<i8'
+	TERM_TOPIC_COUNTS_INDICES = 'term-topic-counts-indices.bin'
+	TERM_TOPIC_COUNTS_INDICES_DTYPE = '<i4'
+	TERM_TOPIC_COUNTS_VALUES = 'term-topic-counts-values.bin'
+	TERM_TOPIC_COUNTS_VALUES_DTYPE = '<f8'
+	TERM_TOPIC_SMOOTHING = 'term-topic-smoothing.json'
+	DOCUMENT_INDEX = 'document-index.txt'
+	DOCUMENT_TOPIC_MATRIX = 'document-topic-matrix.bin'
+	DOCUMENT_TOPIC_MATRIX_DTYPE = '<f4'
 	
 	def __init__( self, path ):
 		self.path = '{}/{}/'.format( path, ModelAPI.SUBFOLDER )
@@ -63,27 +479,176 @@ class ModelAPI( object ):
 		self.topic_count = 0
 		self.term_count = 0
 		self.term_topic_matrix = []
+		self.term_topic_counts = None
+		self.term_topic_smoothing = 0.0
+		self.document_index = []
+		self.document_count = 0
+		self.document_topic_matrix = None
+		self.document_rows = None
 	
 	def read( self ):
+		"""
+		Read the model. With numpy, the term-topic matrix is a terms x topics array of float64,
+		memory-mapped from a binary cache of the text file, which is written on the first read.
+		A model stored as sparse counts is memory-mapped instead, and its smoothed rows are built on demand.
+		"""
 		self.topic_index = ReadAsList( self.path + ModelAPI.TOPIC_INDEX )
 		self.term_index = ReadAsList( self.path + ModelAPI.TERM_INDEX )
-		self.term_topic_matrix = ReadAsMatrix( self.path + ModelAPI.TERM_TOPIC_MATRIX )
+		if self.hasSparse():
+			self.readSparse()
+		elif self.hasCache():
+			self.term_topic_matrix = ReadAsBinaryArray( self.path + ModelAPI.TERM_TOPIC_MATRIX_CACHE, ModelAPI.TERM_TOPIC_MATRIX_CACHE_DTYPE, ( len( self.term_index ), len( self.topic_index ) ) )
+		else:
+			self.term_topic_matrix = ReadAsMatrix( self.path + ModelAPI.TERM_TOPIC_MATRIX )
+			if numpy is not None:
+				self.verify()
+				self.term_topic_matrix = numpy.array( self.term_topic_matrix, dtype = numpy.float64 ).reshape( self.term_count, self.topic_count )
+				self.writeCache()
 		self.verify()
 	
+	def writeCache( self ):
+		"""
+		Write the binary cache of the term-topic matrix to a temporary file first, so that an interrupted write never leaves a truncated cache.
+		The cache is optional: if the model folder is not writable, the matrix is simply kept in memory.
+		"""
+		filename = self.path + ModelAPI.TERM_TOPIC_MATRIX_CACHE
+		try:
+			WriteAsBinaryArray( self.term_topic_matrix, filename + '.tmp', ModelAPI.TERM_TOPIC_MATRIX_CACHE_DTYPE )
+			os.rename( filename + '.tmp', filename )
+		except ( IOError, OSError ):
+			if os.path.exists( filename + '.tmp' ):
+				os.remove( filename + '.tmp' )
+	
+	def hasCache( self ):
+		"""Check for a binary cache of the term-topic matrix that is up to date with the text file."""
+		if numpy is None or not os.path.exists( self.path + ModelAPI.TERM_TOPIC_MATRIX_CACHE ):
+			return False
+		if os.path.getmtime( self.path + ModelAPI.TERM_TOPIC_MATRIX_CACHE ) < os.path.getmtime( self.path + ModelAPI.TERM_TOPIC_MATRIX ):
+			return False
+		itemsize = numpy.dtype( ModelAPI.TERM_TOPIC_MATRIX_CACHE_DTYPE ).itemsize
+		return os.path.getsize( self.path + ModelAPI.TERM_TOPIC_MATRIX_CACHE ) == len( self.term_index ) * len( self.topic_index ) * itemsize
+	
 	def verify( self ):
 		self.topic_count = len( self.topic_index )
 		self.term_count = len( self.term_index )
 		
+		if self.term_topic_counts is not None:
+			( indptr, indices, values ) = self.term_topic_counts
+			assert self.term_count + 1 == len( indptr )
+			assert len( indices ) == len( values )
+			assert self.topic_count == self.term_topic_matrix.column_count
+			if len( indices ) > 0 and numpy is not None:
+				assert numpy.min( indices ) >= 0 and numpy.max( indices ) < self.topic_count
+			elif len( indices ) > 0:
+				assert min( indices ) >= 0 and max( indices ) < self.topic_count
+			return
+		if numpy is not None and isinstance( self.term_topic_matrix, numpy.ndarray ):
+			assert self.term_topic_matrix.shape == ( self.term_count, self.topic_count )
+			return
 		assert self.term_count == len( self.term_topic_matrix )
 		for row in self.term_topic_matrix:
 			assert self.topic_count == len(row)
 	
-	def write( self ):
+	def verifyDocumentTopics( self ):
+		self.document_count = len( self.document_index )
+		assert self.document_count == len( self.document_topic_matrix )
+		if numpy is not None and isinstance( self.document_topic_matrix, numpy.ndarray ):
+			assert self.document_topic_matrix.shape == ( self.document_count, len( self.topic_index ) )
+			return
+		for row in self.document_topic_matrix:
+			assert len( self.topic_index ) == len(row)
+	
+	def hasDocumentTopics( self ):
+		return numpy is not None and os.path.exists( self.path + ModelAPI.DOCUMENT_TOPIC_MATRIX )
+	
+	def readDocumentTopics( self ):
+		"""Memory-map the document-topic matrix, a documents x topics array of float32 in the order of the document index."""
+		if len( self.topic_index ) == 0:
+			self.topic_index = ReadAsList( self.path + ModelAPI.TOPIC_INDEX )
+		self.document_index = ReadAsList( self.path + ModelAPI.DOCUMENT_INDEX )
+		self.document_topic_matrix = ReadAsBinaryArray( self.path + ModelAPI.DOCUMENT_TOPIC_MATRIX, ModelAPI.DOCUMENT_TOPIC_MATRIX_DTYPE, ( len( self.document_index ), len( self.topic_index ) ) )
+		self.document_rows = None
+		self.verifyDocumentTopics()
+	
+	def writeDocumentTopics( self ):
+		self.verifyDocumentTopics()
+		CheckAndMakeDirs( self.path )
+		WriteAsList( self.document_index, self.path + ModelAPI.DOCUMENT_INDEX )
+		WriteAsBinaryArray( self.document_topic_matrix, self.path + ModelAPI.DOCUMENT_TOPIC_MATRIX, ModelAPI.DOCUMENT_TOPIC_MATRIX_DTYPE )
+	
+	def getDocumentTopics( self, docID ):
+		"""Return the topic mixture of a document, as a row of the document-topic matrix."""
+		if self.document_rows is None:
+			self.document_rows = { document : row for row, document in enumerate( self.document_index ) }
+		return self.document_topic_matrix[ self.document_rows[ docID ] ]
+	
+	def getSubmatrix( self, rows ):
+		"""Return the given rows of the term-topic matrix, as lists of floats."""
+		if numpy is not None and isinstance( self.term_topic_matrix, numpy.ndarray ):
+			return self.term_topic_matrix[ rows ].tolist()
+		return [ self.term_topic_matrix[ row ] for row in rows ]
+	
+	def setSparse( self, indptr, indices, values, smoothing = 0.0 ):
+		"""
+		Set the term-topic matrix as sparse counts in compressed sparse row (CSR) form, in the order of term_index:
+		the counts of term i are values[ indptr[i] : indptr[i+1] ], for the topics in the same slice of indices.
+		The smoothing is added to every cell (including missing ones) as rows are requested.
+		Expects topic_index to be set already.
+		"""
+		self.term_topic_counts = ( indptr, indices, values )
+		self.term_topic_smoothing = smoothing
+		self.term_topic_matrix = SmoothedCountMatrix( indptr, indices, values, len( self.topic_index ), smoothing )
+	
+	def hasSparse( self ):
+		return numpy is not None and os.path.exists( self.path + ModelAPI.TERM_TOPIC_COUNTS_INDPTR )
+	
+	def readSparse( self ):
+		"""Memory-map the sparse term-topic counts."""
+		indptr = ReadAsBinaryArray( self.path + ModelAPI.TERM_TOPIC_COUNTS_INDPTR, ModelAPI.TERM_TOPIC_COUNTS_INDPTR_DTYPE )
+		indices = ReadAsBinaryArray( self.path + ModelAPI.TERM_TOPIC_COUNTS_INDICES, ModelAPI.TERM_TOPIC_COUNTS_INDICES_DTYPE )
+		values = ReadAsBinaryArray( self.path + ModelAPI.TERM_TOPIC_COUNTS_VALUES, ModelAPI.TERM_TOPIC_COUNTS_VALUES_DTYPE )
+		smoothing = ReadAsJson( self.path + ModelAPI.TERM_TOPIC_SMOOTHING )['smoothing']
+		self.setSparse( indptr, indices, values, smoothing )
+	
+	def writeSparse( self ):
+		( indptr, indices, values ) = self.term_topic_counts
+		WriteAsBinaryArray( indptr, self.path + ModelAPI.TERM_TOPIC_COUNTS_INDPTR, ModelAPI.TERM_TOPIC_COUNTS_INDPTR_DTYPE )
+		WriteAsBinaryArray( indices, self.path + ModelAPI.TERM_TOPIC_COUNTS_INDICES, ModelAPI.TERM_TOPIC_COUNTS_INDICES_DTYPE )
+		WriteAsBinaryArray( values, self.path + ModelAPI.TERM_TOPIC_COUNTS_VALUES, ModelAPI.TERM_TOPIC_COUNTS_VALUES_DTYPE )
+		WriteAsJson( { 'smoothing' : self.term_topic_smoothing }, self.path + ModelAPI.TERM_TOPIC_SMOOTHING )
+	
+	def write( self, dense = False ):
+		"""
+		Write the model to disk. Sparse term-topic counts are written as binary arrays (requires numpy),
+		and only also exported as a dense text matrix if requested; all other models are written as a dense text matrix.
+		"""
 		self.verify()
 		CheckAndMakeDirs( self.path )
 		WriteAsList( self.topic_index, self.path + ModelAPI.TOPIC_INDEX )
 		WriteAsList( self.term_index, self.path + ModelAPI.TERM_INDEX )
-		WriteAsMatrix( self.term_topic_matrix, self.path + ModelAPI.TERM_TOPIC_MATRIX )
+		sparse = self.term_topic_counts is not None and numpy is not None
+		if sparse:
+			self.writeSparse()
+		else:
+			for filename in [ ModelAPI.TERM_TOPIC_COUNTS_INDPTR, ModelAPI.TERM_TOPIC_COUNTS_INDICES, ModelAPI.TERM_TOPIC_COUNTS_VALUES, ModelAPI.TERM_TOPIC_SMOOTHING ]:
+				if os.path.exists( self.path + filename ):
+					os.remove( self.path + filename )
+		if sparse and not dense:
+			if os.path.exists( self.path + ModelAPI.TERM_TOPIC_MATRIX ):
+				os.remove( self.path + ModelAPI.TERM_TOPIC_MATRIX )
+		elif numpy is not None and isinstance( self.term_topic_matrix, numpy.ndarray ):
+			WriteAsMatrix( self.term_topic_matrix.tolist(), self.path + ModelAPI.TERM_TOPIC_MATRIX )
+		else:
+			WriteAsMatrix( self.term_topic_matrix, self.path + ModelAPI.TERM_TOPIC_MATRIX )
+		# The cache holds the matrix as read back from the text file, so it is rebuilt on the next read
+		if os.path.exists( self.path + ModelAPI.TERM_TOPIC_MATRIX_CACHE ):
+			os.remove( self.path + ModelAPI.TERM_TOPIC_MATRIX_CACHE )
+		if self.document_topic_matrix is not None and numpy is not None:
+			self.writeDocumentTopics()
+		else:
+			for filename in [ ModelAPI.DOCUMENT_INDEX, ModelAPI.DOCUMENT_TOPIC_MATRIX ]:
+				if os.path.exists( self.path + filename ):
+					os.remove( self.path + filename )
 
 class SaliencyAPI( object ):
 	SUBFOLDER = 'saliency'
@@ -122,6 +687,13 @@ class SimilarityAPI( object ):
 	WINDOW_G2 = 'window-g2.txt'
 	COLLOCATAPIN_G2 = 'collocation-g2.txt'
 	COMBINED_G2 = 'combined-g2.txt'
+	COMBINED_G2_TERMS = 'combined-g2-terms.txt'
+	COMBINED_G2_INDPTR = 'combined-g2-indptr.bin'
+	COMBINED_G2_INDPTR_DTYPE = '<i8'
+	COMBINED_G2_INDICES = 'combined-g2-indices.bin'
+	COMBINED_G2_INDICES_DTYPE = '<i4'
+	COMBINED_G2_DATA = 'combined-g2-data.bin'
+	COMBINED_G2_DATA_DTYPE = '<f8'
 	
 	def __init__( self, path ):
 		self.path = '{}/{}/'.format( path, SimilarityAPI.SUBFOLDER )
@@ -135,6 +707,11 @@ class SimilarityAPI( object ):
 		self.window_g2 = {}
 		self.collcation_g2 = {}
 		self.combined_g2 = {}
+		self.term_index = []
+		self.term_ids = {}
+		self.combined_g2_indptr = None
+		self.combined_g2_indices = None
+		self.combined_g2_data = None
 	
 	def read( self ):
 #		self.document_occurrence = ReadAsSparseVector( self.path + SimilarityAPI.DOCUMENT_OCCURRENCE )
@@ -160,11 +737,62 @@ class SimilarityAPI( object ):
 #		WriteAsSparseMatrix( self.window_g2, self.path + SimilarityAPI.WINDOW_G2 )
 #		WriteAsSparseMatrix( self.collocation_g2, self.path + SimilarityAPI.COLLOCATAPIN_G2 )
 		WriteAsSparseMatrix( self.combined_g2, self.path + SimilarityAPI.COMBINED_G2 )
+		if self.combined_g2_data is not None:
+			self.writeEncoded()
+	
+	def setEncoded( self, term_index, indptr, indices, data ):
+		"""
+		Set the combined similarity matrix in compressed sparse row (CSR) form:
+		the scores of the term term_index[i] are data[ indptr[i] : indptr[i+1] ],
+		against the terms in the same slice of indices (sorted within each row).
+		"""
+		self.term_index = term_index
+		self.term_ids = { term : termID for termID, term in enumerate( term_index ) }
+		self.combined_g2_indptr = indptr
+		self.combined_g2_indices = indices
+		self.combined_g2_data = data
+	
+	def hasEncoded( self ):
+		return numpy is not None and os.path.exists( self.path + SimilarityAPI.COMBINED_G2_DATA )
+	
+	def readEncoded( self ):
+		"""Memory-map the combined similarity matrix in CSR form, without loading it into a dict."""
+		self.setEncoded(
+			ReadAsList( self.path + SimilarityAPI.COMBINED_G2_TERMS ),
+			ReadAsBinaryArray( self.path + SimilarityAPI.COMBINED_G2_INDPTR, SimilarityAPI.COMBINED_G2_INDPTR_DTYPE ),
+			ReadAsBinaryArray( self.path + SimilarityAPI.COMBINED_G2_INDICES, SimilarityAPI.COMBINED_G2_INDICES_DTYPE ),
+			ReadAsBinaryArray( self.path + SimilarityAPI.COMBINED_G2_DATA, SimilarityAPI.COMBINED_G2_DATA_DTYPE )
+		)
+	
+	def writeEncoded( self ):
+		CheckAndMakeDirs( self.path )
+		WriteAsList( self.term_index, self.path + SimilarityAPI.COMBINED_G2_TERMS )
+		WriteAsBinaryArray( self.combined_g2_indptr, self.path + SimilarityAPI.COMBINED_G2_INDPTR, SimilarityAPI.COMBINED_G2_INDPTR_DTYPE )
+		WriteAsBinaryArray( self.combined_g2_indices, self.path + SimilarityAPI.COMBINED_G2_INDICES, SimilarityAPI.COMBINED_G2_INDICES_DTYPE )
+		WriteAsBinaryArray( self.combined_g2_data, self.path + SimilarityAPI.COMBINED_G2_DATA, SimilarityAPI.COMBINED_G2_DATA_DTYPE )
+	
+	def getCombinedG2( self, firstTerm, secondTerm ):
+		"""Return the combined similarity score between two terms, or 0.0 if there is none."""
+		if self.combined_g2_data is None:
+			return self.combined_g2.get( ( firstTerm, secondTerm ), 0.0 )
+		if firstTerm not in self.term_ids or secondTerm not in self.term_ids:
+			return 0.0
+		return self.getEncodedG2( self.term_ids[ firstTerm ], self.term_ids[ secondTerm ] )
+	
+	def getEncodedG2( self, firstID, secondID ):
+		"""Return the combined similarity score between two term IDs, or 0.0 if there is none."""
+		start = self.combined_g2_indptr[ firstID ]
+		end = self.combined_g2_indptr[ firstID + 1 ]
+		position = start + numpy.searchsorted( self.combined_g2_indices[ start : end ], secondID )
+		if position < end and self.combined_g2_indices[ position ] == secondID:
+			return float( self.combined_g2_data[ position ] )
+		return 0.0
 
 class SeriationAPI( object ):
 	SUBFOLDER = 'seriation'
 	TERM_ORDERING = 'term-ordering.txt'
 	TERM_ITER_INDEX = 'term-iter-index.txt'
+	CHECKPOINT = 'checkpoint.json'
 	
 	def __init__( self, path ):
 		self.path = '{}/{}/'.format( path, SeriationAPI.SUBFOLDER )
@@ -179,6 +807,19 @@ class SeriationAPI( object ):
 		CheckAndMakeDirs( self.path )
 		WriteAsList( self.term_ordering, self.path + SeriationAPI.TERM_ORDERING )
 		WriteAsList( self.term_iter_index, self.path + SeriationAPI.TERM_ITER_INDEX )
+	
+	def hasCheckpoint( self ):
+		return os.path.exists( self.path + SeriationAPI.CHECKPOINT )
+	
+	def readCheckpoint( self ):
+		return ReadAsJson( self.path + SeriationAPI.CHECKPOINT )
+	
+	def writeCheckpoint( self, checkpoint ):
+		"""Write the checkpoint to a temporary file first, so that an interrupted write never replaces the previous checkpoint."""
+		CheckAndMakeDirs( self.path )
+		filename = self.path + SeriationAPI.CHECKPOINT
+		WriteAsJson( checkpoint, filename + '.tmp' )
+		os.rename( filename + '.tmp', filename )
 
 class ClientAPI( object ):
 	SUBFOLDER = 'public_html/data'
@@ -7,7 +7,12 @@ import ConfigParser
 import logging
 
 import math
-from api_utils import ModelAPI, SaliencyAPI
+from api_utils import ModelAPI, SaliencyAPI, SmoothedCountMatrix
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
 
 class ComputeSaliency( object ):
 	"""
@@ -32,6 +37,13 @@ class ComputeSaliency( object ):
 	duplicate formats, a tab-delimited file and a JSON object:
 	    'topic-info.txt'
 	    'topic-info.json'
+	
+	When numpy is available, the statistics for all terms are computed as
+	array operations over the entire term-topic matrix. Otherwise, the terms
+	are processed one at a time. A term-topic matrix of sparse counts with
+	constant smoothing (see SmoothedCountMatrix) is never densified: the
+	smoothing is added to the row and column sums of the counts, and to the
+	distinctiveness in closed form.
 	"""
 	
 	def __init__( self, logging_level ):
@@ -67,7 +79,14 @@ class ComputeSaliency( object ):
 		self.logger.info( '--------------------------------------------------------------------------------' )
 	
 	def computeTopicInfo( self ):
-		topic_weights = [ sum(x) for x in zip( *self.model.term_topic_matrix ) ]
+		matrix = self.model.term_topic_matrix
+		if numpy is not None and isinstance( matrix, SmoothedCountMatrix ):
+			counts = numpy.bincount( numpy.asarray( matrix.indices, dtype = numpy.intp ), weights = numpy.asarray( matrix.values, dtype = numpy.float64 ), minlength = self.model.topic_count )
+			topic_weights = ( counts + self.model.term_count * matrix.smoothing ).tolist()
+		elif numpy is not None:
+			topic_weights = numpy.asarray( self.model.term_topic_matrix, dtype = numpy.float64 ).sum( axis = 0 ).tolist()
+		else:
+			topic_weights = [ sum(x) for x in zip( *self.model.term_topic_matrix ) ]
 		topic_info = []
 		for i in range(self.model.topic_count):
 			topic_info.append( {
@@ -81,13 +100,24 @@ class ComputeSaliency( object ):
 		"""Iterate over the list of terms. Compute frequency, distinctiveness, saliency."""
 		
 		topic_marginal = self.getNormalized( [ d['weight'] for d in self.saliency.topic_info ] )
+		if numpy is not None and isinstance( self.model.term_topic_matrix, SmoothedCountMatrix ):
+			( frequencies, distinctivenesses ) = self.getSparseTermStatistics( topic_marginal )
+		elif numpy is not None:
+			( frequencies, distinctivenesses ) = self.getTermStatistics( topic_marginal )
+		else:
+			frequencies = []
+			distinctivenesses = []
+			for i in range(self.model.term_count):
+				counts = self.model.term_topic_matrix[i]
+				probs = self.getNormalized( counts )
+				frequencies.append( sum( counts ) )
+				distinctivenesses.append( self.getKLDivergence( probs, topic_marginal ) )
+		
 		term_info = []
 		for i in range(self.model.term_count):
 			term = self.model.term_index[i]
-			counts = self.model.term_topic_matrix[i]
-			frequency = sum( counts )
-			probs = self.getNormalized( counts )
-			distinctiveness = self.getKLDivergence( probs, topic_marginal )
+			frequency = frequencies[i]
+			distinctiveness = distinctivenesses[i]
 			saliency = frequency * distinctiveness
 			term_info.append( {
 				'term' : term,
@@ -99,6 +129,54 @@ class ComputeSaliency( object ):
 			} )
 		self.saliency.term_info = term_info
 	
+	def getTermStatistics( self, topic_marginal ):
+		"""Compute frequency and distinctiveness (KL-divergence from the topic marginal) of all terms at once."""
+		matrix = numpy.asarray( self.model.term_topic_matrix, dtype = numpy.float64 ).reshape( self.model.term_count, self.model.topic_count )
+		marginal = numpy.asarray( topic_marginal, dtype = numpy.float64 )
+		assert ( matrix >= 0 ).all()
+		assert ( marginal >= 0 ).all()
+		
+		frequencies = matrix.sum( axis = 1 )
+		tallies = numpy.where( frequencies == 0, 1.0, frequencies )
+		probs = matrix / tallies[ :, numpy.newaxis ]
+		with numpy.errstate( divide = 'ignore', invalid = 'ignore' ):
+			terms = numpy.where( probs > 0, probs * numpy.log( probs / marginal ), 0.0 )
+		distinctivenesses = terms.sum( axis = 1 )
+		return frequencies.tolist(), distinctivenesses.tolist()
+	
+	def getSparseTermStatistics( self, topic_marginal ):
+		"""
+		Same as getTermStatistics, for a matrix of sparse counts c with smoothing s added to every cell.
+		In a row with total f, each of the columns without counts has probability q = s / f, and together
+		they add q * sum( log( q / marginal ) ) over those columns to the KL-divergence.
+		"""
+		matrix = self.model.term_topic_matrix
+		indptr = numpy.asarray( matrix.indptr, dtype = numpy.intp )
+		indices = numpy.asarray( matrix.indices, dtype = numpy.intp )
+		values = numpy.asarray( matrix.values, dtype = numpy.float64 )
+		smoothing = float( matrix.smoothing )
+		marginal = numpy.asarray( topic_marginal, dtype = numpy.float64 )
+		assert ( values >= 0 ).all()
+		assert smoothing >= 0
+		assert ( marginal >= 0 ).all()
+		
+		term_count = self.model.term_count
+		topic_count = self.model.topic_count
+		nonzeros = numpy.diff( indptr )
+		rows = numpy.repeat( numpy.arange( term_count ), nonzeros )
+		frequencies = numpy.bincount( rows, weights = values, minlength = term_count ) + topic_count * smoothing
+		tallies = numpy.where( frequencies == 0, 1.0, frequencies )
+		probs = ( values + smoothing ) / tallies[ rows ]
+		with numpy.errstate( divide = 'ignore', invalid = 'ignore' ):
+			terms = numpy.where( probs > 0, probs * numpy.log( probs / marginal[ indices ] ), 0.0 )
+		distinctivenesses = numpy.bincount( rows, weights = terms, minlength = term_count )
+		if smoothing > 0:
+			logMarginal = numpy.log( marginal )
+			otherLogMarginal = logMarginal.sum() - numpy.bincount( rows, weights = logMarginal[ indices ], minlength = term_count )
+			probs = smoothing / tallies
+			distinctivenesses += probs * ( ( topic_count - nonzeros ) * numpy.log( probs ) - otherLogMarginal )
+		return frequencies.tolist(), distinctivenesses.tolist()
+	
 	def getNormalized( self, counts ):
 		"""Rescale a list of counts, so they represent a proper probability distribution."""
 		tally = sum( counts )
@@ -1,15 +1,26 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import os
 import sys
 import argparse
 import ConfigParser
 import logging
 
 import time
+import heapq
+import itertools
 from operator import itemgetter
+from io_utils import CheckAndMakeDirs, WriteAsJson
 from api_utils import SaliencyAPI, SimilarityAPI, SeriationAPI
 
+try:
+	import numpy
+	import scipy.sparse
+except ImportError:
+	numpy = None
+	scipy = None
+
 class ComputeSeriation( object ):
 	"""Seriation algorithm.
 
@@ -18,9 +29,23 @@ class ComputeSeriation( object ):
 	
 	As output, the algorithm produces a list of seriated terms and its 'ranking'
 	(i.e., the iteration in which a term was seriated).
+	
+	The seriation is checkpointed periodically and when it completes. It can be
+	resumed from the checkpoint, including to extend it to more terms, as long as
+	the saliency and similarity data have not changed since the checkpoint.
+	Progress (iterations per second, candidates checked, early-break rate, and
+	ETA) is logged periodically, and optionally written to a JSON metrics file.
+	
+	When numpy and scipy are available, terms are indexed by their position in
+	the saliency ordering, and similarity scores are looked up in sparse rows
+	and columns over term IDs, and in a dense sub-matrix for the terms that
+	can be seriated, instead of in a dict keyed by pairs of terms.
 	"""
 	
 	DEFAULT_NUM_SERIATED_TERMS = 100
+	CANDIDATE_BATCH_SIZE = 64
+	DEFAULT_CHECKPOINT_INTERVAL = 100
+	DEFAULT_PROGRESS_INTERVAL = 50
 	
 	def __init__( self, logging_level ):
 		self.logger = logging.getLogger( 'ComputeSeriation' )
@@ -29,16 +54,24 @@ class ComputeSeriation( object ):
 		handler.setLevel( logging_level )
 		self.logger.addHandler( handler )
 	
-	def execute( self, data_path, numSeriatedTerms = None ):
+	def execute( self, data_path, numSeriatedTerms = None, resume = False, checkpointInterval = None, progressInterval = None, metricsFile = None ):
 		
 		assert data_path is not None
 		if numSeriatedTerms is None:
 			numSeriatedTerms = ComputeSeriation.DEFAULT_NUM_SERIATED_TERMS
+		if checkpointInterval is None:
+			checkpointInterval = ComputeSeriation.DEFAULT_CHECKPOINT_INTERVAL
+		if progressInterval is None:
+			progressInterval = ComputeSeriation.DEFAULT_PROGRESS_INTERVAL
 		
 		self.logger.info( '--------------------------------------------------------------------------------' )
 		self.logger.info( 'Computing term seriation...'                                                      )
 		self.logger.info( '    data_path = %s', data_path                                                    )
 		self.logger.info( '    number_of_seriated_terms = %d', numSeriatedTerms                              )
+		self.logger.info( '    resume = %s', resume                                                          )
+		self.logger.info( '    checkpoint_interval = %d', checkpointInterval                                 )
+		self.logger.info( '    progress_interval = %d', progressInterval                                     )
+		self.logger.info( '    metrics_file = %s', metricsFile                                               )
 		
 		self.logger.info( 'Connecting to data...' )
 		self.saliency = SaliencyAPI( data_path )
@@ -47,19 +80,40 @@ class ComputeSeriation( object ):
 		
 		self.logger.info( 'Reading data from disk...' )
 		self.saliency.read()
-		self.similarity.read()
+		if self.similarity.hasEncoded():
+			self.similarity.readEncoded()
+		else:
+			self.similarity.read()
 		
 		self.logger.info( 'Reshaping saliency data...' )
 		self.reshape()
+		self.fingerprint = self.getFingerprint()
+		
+		checkpoint = None
+		if resume:
+			if self.seriation.hasCheckpoint():
+				self.logger.info( 'Reading checkpoint from disk...' )
+				checkpoint = self.seriation.readCheckpoint()
+				assert checkpoint.get( 'fingerprint' ) == self.fingerprint, 'Checkpoint {} was computed from different data than {} and {}; rerun without --resume'.format( self.seriation.path + SeriationAPI.CHECKPOINT, self.saliency.path + SaliencyAPI.TERM_SALIENCY, self.similarity.path + SimilarityAPI.COMBINED_G2 )
+			else:
+				self.logger.info( 'No checkpoint found; starting from the beginning' )
 		
 		self.logger.info( 'Computing seriation...' )
-		self.compute( numSeriatedTerms )
+		self.compute( numSeriatedTerms, checkpoint, checkpointInterval, progressInterval, metricsFile )
 		
 		self.logger.info( 'Writing data to disk...' )
 		self.seriation.write()
 		
 		self.logger.info( '--------------------------------------------------------------------------------' )
 	
+	def getFingerprint( self ):
+		"""Identify the saliency and similarity data by the size and modification time of their files."""
+		fingerprint = {}
+		for filename in [ self.saliency.path + SaliencyAPI.TERM_SALIENCY, self.similarity.path + SimilarityAPI.COMBINED_G2 ]:
+			stat = os.stat( filename )
+			fingerprint[ os.path.basename( filename ) ] = [ stat.st_size, stat.st_mtime ]
+		return fingerprint
+	
 	def reshape( self ):
 		self.candidateSize = 100
 		self.orderedTermList = []
@@ -77,23 +131,52 @@ class ComputeSeriation( object ):
 			self.termRank[term] = element['rank']
 			self.termVisibility[term] = element['visibility']
 	
-	def compute( self, numSeriatedTerms ):
+	def compute( self, numSeriatedTerms, checkpoint = None, checkpointInterval = 0, progressInterval = 0, metricsFile = None ):
 		# Elicit from user (1) the number of terms to output and (2) a list of terms that should be included in the output...
 		# set in init (i.e. read from config file)
 		
 		# Seriate!
 		start_time = time.time()
-		candidateTerms = self.orderedTermList
+		self.checkpointInterval = checkpointInterval
+		self.progressInterval = progressInterval
+		self.metricsFile = metricsFile
 		self.seriation.term_ordering = []
 		self.seriation.term_iter_index = []
 		self.buffers = [0,0]
+		if checkpoint is not None and not self.restoreCheckpoint( checkpoint, numSeriatedTerms ):
+			self.logger.info( 'Checkpoint already contains %d seriated terms', numSeriatedTerms )
+		else:
+			self.startProgress( numSeriatedTerms )
+			if numpy is not None:
+				self.computeByID( numSeriatedTerms, checkpoint )
+			else:
+				self.computeByTerm( numSeriatedTerms, checkpoint )
+			if self.progress['reported_terms'] != len( self.seriation.term_iter_index ):
+				self.reportProgress( len( self.seriation.term_iter_index ) )
+		seriation_time = time.time() - start_time
 		
+		# Output consists of (1) a list of ordered terms, and (2) the iteration index in which a term was ordered
+		#print "term_ordering: ", self.seriation.term_ordering
+		#print "term_iter_index: ", self.seriation.term_iter_index   # Feel free to pick a less confusing variable name
+		
+		#print "similarity matrix generation time: ", compute_sim_time
+		#print "seriation time: ", seriation_time
+		self.logger.debug("seriation time: " +  str(seriation_time))
+	
+	def computeByTerm( self, numSeriatedTerms, checkpoint = None ):
+		candidateTerms = self.orderedTermList
 		preBest = []
 		postBest = []
+		if checkpoint is not None:
+			seriated = frozenset( self.seriation.term_iter_index )
+			candidateTerms = [ term for term in self.orderedTermList if term not in seriated ]
+			# The last seriated term is removed from the best energies at the start of the next iteration
+			if len( self.seriation.term_iter_index ) > 1:
+				addedTerm = self.seriation.term_iter_index[-1]
+				preBest = [ ( term, checkpoint['pre_best'].get( term, 0 ) ) for term in self.orderedTermList if term not in seriated or term == addedTerm ]
+				postBest = [ ( term, checkpoint['post_best'].get( term, 0 ) ) for term in self.orderedTermList if term not in seriated or term == addedTerm ]
 		
-		for iteration in range(numSeriatedTerms):
-			print "Iteration no. ", iteration
-			
+		for iteration in range(len(self.seriation.term_iter_index), numSeriatedTerms):
 			addedTerm = 0
 			if len(self.seriation.term_iter_index) > 0:
 				addedTerm = self.seriation.term_iter_index[-1]
@@ -101,17 +184,139 @@ class ComputeSeriation( object ):
 				(preBest, postBest) = self.initBestEnergies(addedTerm, candidateTerms)
 			(preBest, postBest, self.bestEnergies) = self.getBestEnergies(preBest, postBest, addedTerm)
 			(candidateTerms, self.seriation.term_ordering, self.seriation.term_iter_index, self.buffers) = self.iterate_eff(candidateTerms, self.seriation.term_ordering, self.seriation.term_iter_index, self.buffers, self.bestEnergies, iteration)
-			
-			print "---------------"
-		seriation_time = time.time() - start_time
+			if len(self.seriation.term_iter_index) <= iteration:
+				self.logger.warning("No remaining term improves the seriation; stopping after %d terms", iteration)
+				break
+			if self.checkpointInterval > 0 and (iteration+1) % self.checkpointInterval == 0:
+				self.saveCheckpoint(preBest, postBest)
+			if self.progressInterval > 0 and (iteration+1) % self.progressInterval == 0:
+				self.reportProgress(iteration+1)
+		self.saveCheckpoint(preBest, postBest)
+	
+	def computeByID( self, numSeriatedTerms, checkpoint = None ):
+		self.indexSimilarity( numSeriatedTerms )
+		termIDs = { term : termID for termID, term in enumerate( self.orderedTermList ) }
+		self.term_ordering = [ termIDs[term] for term in self.seriation.term_ordering ]
+		self.term_iter_index = [ termIDs[term] for term in self.seriation.term_iter_index ]
+		self.active = numpy.ones( len( self.orderedTermList ), dtype = bool )
+		self.active[ self.term_iter_index ] = False
+		self.heap = []
+		self.popped = []
+		if checkpoint is not None and len( self.term_iter_index ) > 1:
+			self.preBest = numpy.zeros( len( self.orderedTermList ), dtype = numpy.float64 )
+			self.postBest = numpy.zeros( len( self.orderedTermList ), dtype = numpy.float64 )
+			for ( term, score ) in checkpoint['pre_best'].iteritems():
+				self.preBest[ termIDs[term] ] = score
+			for ( term, score ) in checkpoint['post_best'].iteritems():
+				self.postBest[ termIDs[term] ] = score
+			self.buildBestCandidates()
 		
-		# Output consists of (1) a list of ordered terms, and (2) the iteration index in which a term was ordered
-		#print "term_ordering: ", self.seriation.term_ordering
-		#print "term_iter_index: ", self.seriation.term_iter_index   # Feel free to pick a less confusing variable name
+		for iteration in range(len(self.term_iter_index), numSeriatedTerms):
+			if iteration == 0:
+				candidates = ( (termID, None) for termID in xrange(len(self.orderedTermList)) )
+			else:
+				addedID = self.term_iter_index[-1]
+				if iteration == 1:
+					self.initBestEnergiesByID(addedID)
+				else:
+					self.updateBestEnergiesByID(addedID)
+				candidates = self.popBestCandidates()
+			self.iterateByID(candidates, iteration)
+			self.restoreBestCandidates()
+			if len(self.term_iter_index) <= iteration:
+				self.logger.warning("No remaining term improves the seriation; stopping after %d terms", iteration)
+				break
+			if self.checkpointInterval > 0 and (iteration+1) % self.checkpointInterval == 0:
+				self.saveCheckpointByID()
+			if self.progressInterval > 0 and (iteration+1) % self.progressInterval == 0:
+				self.reportProgress(iteration+1)
+		self.saveCheckpointByID()
+	
+	def startProgress( self, numSeriatedTerms ):
+		self.progress = {
+			'target_terms' : numSeriatedTerms,
+			'initial_terms' : len( self.seriation.term_iter_index ),
+			'start_time' : time.time(),
+			'iterations' : 0,
+			'candidates_checked' : 0,
+			'early_breaks' : 0,
+			'reported_terms' : None
+		}
+	
+	def recordIteration( self, candidatesChecked, brokeEarly ):
+		self.progress['iterations'] += 1
+		self.progress['candidates_checked'] += candidatesChecked
+		if brokeEarly:
+			self.progress['early_breaks'] += 1
+	
+	def reportProgress( self, seriatedTerms ):
+		"""Log progress since the start of this run, and write it to the metrics file if there is one."""
+		progress = self.progress
+		progress['reported_terms'] = seriatedTerms
+		elapsed = time.time() - progress['start_time']
+		iterations = progress['iterations']
+		iterationsPerSecond = iterations / elapsed if elapsed > 0 else 0.0
+		remaining = progress['target_terms'] - seriatedTerms
+		metrics = {
+			'seriated_terms' : seriatedTerms,
+			'target_terms' : progress['target_terms'],
+			'iterations' : iterations,
+			'elapsed_seconds' : elapsed,
+			'iterations_per_second' : iterationsPerSecond,
+			'candidates_checked' : progress['candidates_checked'],
+			'candidates_checked_per_iteration' : float( progress['candidates_checked'] ) / iterations if iterations > 0 else 0.0,
+			'early_break_rate' : float( progress['early_breaks'] ) / iterations if iterations > 0 else 0.0,
+			'eta_seconds' : remaining / iterationsPerSecond if iterationsPerSecond > 0 else None
+		}
+		self.logger.info( '    Seriated %d/%d terms (%.1f iterations/s, %.1f candidates checked per iteration, %.0f%% early breaks, ETA %s)',
+			seriatedTerms, progress['target_terms'], iterationsPerSecond, metrics['candidates_checked_per_iteration'], 100 * metrics['early_break_rate'],
+			'{:.0f}s'.format( metrics['eta_seconds'] ) if metrics['eta_seconds'] is not None else 'unknown' )
+		if self.metricsFile is not None:
+			if len( os.path.dirname( self.metricsFile ) ) > 0:
+				CheckAndMakeDirs( os.path.dirname( self.metricsFile ) )
+			WriteAsJson( metrics, self.metricsFile )
+	
+	def restoreCheckpoint( self, checkpoint, numSeriatedTerms ):
+		"""
+		Restore the term ordering and buffers from a checkpoint; return whether seriation continues from it.
+		If the checkpoint has more terms than requested, keep the first numSeriatedTerms seriated terms instead
+		(terms are only ever inserted, so they remain in the same relative order).
+		"""
+		for term in checkpoint['term_iter_index']:
+			assert term in self.termRank, 'Seriated term is missing from the saliency data: {}'.format( term.encode( 'utf-8' ) )
 		
-		#print "similarity matrix generation time: ", compute_sim_time
-		#print "seriation time: ", seriation_time
-		self.logger.debug("seriation time: " +  str(seriation_time))
+		self.logger.info( '    Resuming after %d seriated terms', len( checkpoint['term_iter_index'] ) )
+		if len( checkpoint['term_iter_index'] ) >= numSeriatedTerms:
+			seriated = frozenset( checkpoint['term_iter_index'][:numSeriatedTerms] )
+			self.seriation.term_ordering = [ term for term in checkpoint['term_ordering'] if term in seriated ]
+			self.seriation.term_iter_index = checkpoint['term_iter_index'][:numSeriatedTerms]
+			return False
+		self.seriation.term_ordering = checkpoint['term_ordering']
+		self.seriation.term_iter_index = checkpoint['term_iter_index']
+		self.buffers = checkpoint['buffers']
+		return True
+	
+	def saveCheckpoint( self, preBest, postBest ):
+		"""Write the term ordering, buffers, and best energies (of terms with nonzero scores) to disk, with the fingerprint of the input data."""
+		self.seriation.writeCheckpoint( {
+			'fingerprint' : self.fingerprint,
+			'term_ordering' : self.seriation.term_ordering,
+			'term_iter_index' : self.seriation.term_iter_index,
+			'buffers' : [ float( score ) for score in self.buffers ],
+			'pre_best' : { term : float( score ) for ( term, score ) in preBest if score != 0 },
+			'post_best' : { term : float( score ) for ( term, score ) in postBest if score != 0 }
+		} )
+		self.logger.debug( 'Saved checkpoint after %d seriated terms', len( self.seriation.term_iter_index ) )
+	
+	def saveCheckpointByID( self ):
+		self.seriation.term_ordering = [ self.orderedTermList[termID] for termID in self.term_ordering ]
+		self.seriation.term_iter_index = [ self.orderedTermList[termID] for termID in self.term_iter_index ]
+		preBest = []
+		postBest = []
+		if len( self.term_iter_index ) > 1:
+			preBest = [ ( self.orderedTermList[termID], self.preBest[termID] ) for termID in numpy.flatnonzero( self.preBest ) ]
+			postBest = [ ( self.orderedTermList[termID], self.postBest[termID] ) for termID in numpy.flatnonzero( self.postBest ) ]
+		self.saveCheckpoint( preBest, postBest )
 
 #-------------------------------------------------------------------------------#
 # Helper Functions
@@ -121,15 +326,10 @@ class ComputeSeriation( object ):
 		preBest = []
 		postBest = []
 		for candidate in candidateTerms:
-			pre_score = 0
-			post_score = 0
-			
 			# preBest
-			if (candidate, firstTerm) in self.similarity.combined_g2:
-				pre_score = self.similarity.combined_g2[(candidate, firstTerm)]
+			pre_score = self.similarity.getCombinedG2(candidate, firstTerm)
 			# postBest
-			if (firstTerm, candidate) in self.similarity.combined_g2:
-				post_score = self.similarity.combined_g2[(firstTerm, candidate)]
+			post_score = self.similarity.getCombinedG2(firstTerm, candidate)
 			
 			preBest.append((candidate, pre_score))
 			postBest.append((candidate, post_score))
@@ -149,13 +349,13 @@ class ComputeSeriation( object ):
 				remove_index = existingIndex
 			
 			# check pre energies
-			if (term, addedTerm) in self.similarity.combined_g2:
-				if self.similarity.combined_g2[(term, addedTerm)] > preBest[existingIndex][1]:
-					preBest[existingIndex] = (term, self.similarity.combined_g2[(term, addedTerm)])
+			pre_score = self.similarity.getCombinedG2(term, addedTerm)
+			if pre_score > preBest[existingIndex][1]:
+				preBest[existingIndex] = (term, pre_score)
 			# check post energies
-			if (addedTerm, term) in self.similarity.combined_g2:
-				if self.similarity.combined_g2[(addedTerm, term)] > postBest[existingIndex][1]:
-					postBest[existingIndex] = (term, self.similarity.combined_g2[(addedTerm, term)])
+			post_score = self.similarity.getCombinedG2(addedTerm, term)
+			if post_score > postBest[existingIndex][1]:
+				postBest[existingIndex] = (term, post_score)
 		
 		# remove the added term's preBest and postBest scores
 		if remove_index != -1:
@@ -179,6 +379,7 @@ class ComputeSeriation( object ):
 			bestEnergy_terms = candidateTerms
 		
 		breakout_counter = 0
+		breakout = False
 		for candidate_index in range(len(bestEnergy_terms)):
 			breakout_counter += 1
 			candidate = bestEnergy_terms[candidate_index]
@@ -194,14 +395,14 @@ class ComputeSeriation( object ):
 			# check for early termination
 			if candidate_index < len(bestEnergy_terms)-1 and len(bestEnergies) != 0:
 				if maxEnergyChange >= (2*(bestEnergies[candidate_index][1] + current_buffer)):
-					print "#-------- breaking out early ---------#"
-					print "candidates checked: ", breakout_counter
+					breakout = True
 					break;
 		
-		print "change in energy: ", maxEnergyChange
-		print "maxTerm: ", maxTerm
-		print "maxPosition: ", maxPosition
+		self.recordIteration(breakout_counter, breakout)
+		self.logger.debug("Iteration %d: candidates checked = %d, change in energy = %s, maxTerm = %s, maxPosition = %d", iteration_no, breakout_counter, maxEnergyChange, maxTerm, maxPosition)
 		
+		if maxTerm == "":
+			return (candidateTerms, term_ordering, term_iter_index, buffers)
 		candidateTerms.remove(maxTerm)
 		
 		# update buffers
@@ -209,21 +410,16 @@ class ComputeSeriation( object ):
 		if len(term_ordering) == 0:
 			buffers = buffers
 		elif maxPosition >= len(term_ordering):
-			if (term_ordering[-1], maxTerm) in self.similarity.combined_g2:
-				buf_score = self.similarity.combined_g2[(term_ordering[-1], maxTerm)]
+			buf_score = self.similarity.getCombinedG2(term_ordering[-1], maxTerm)
 			buffers.insert(len(buffers)-1, buf_score)
 		elif maxPosition == 0:
-			if (maxTerm, term_ordering[0]) in self.similarity.combined_g2:
-				buf_score = self.similarity.combined_g2[(maxTerm, term_ordering[0])]
+			buf_score = self.similarity.getCombinedG2(maxTerm, term_ordering[0])
 			buffers.insert(1, buf_score)
 		else:
-			if (term_ordering[maxPosition-1], maxTerm) in self.similarity.combined_g2:
-				buf_score = self.similarity.combined_g2[(term_ordering[maxPosition-1], maxTerm)]
+			buf_score = self.similarity.getCombinedG2(term_ordering[maxPosition-1], maxTerm)
 			buffers[maxPosition] = buf_score
 			
-			buf_score = 0
-			if (maxTerm, term_ordering[maxPosition]) in self.similarity.combined_g2:
-				buf_score = self.similarity.combined_g2[(maxTerm, term_ordering[maxPosition])]
+			buf_score = self.similarity.getCombinedG2(maxTerm, term_ordering[maxPosition])
 			buffers.insert(maxPosition+1, buf_score)
 		
 		# update term ordering and ranking
@@ -254,17 +450,202 @@ class ComputeSeriation( object ):
 		# get previous term
 		if position > 0:
 			prev_term = term_list[position-1]
-			if (prev_term, candidateTerm) in self.similarity.combined_g2:
-				prevBond = self.similarity.combined_g2[(prev_term, candidateTerm)]
+			prevBond = self.similarity.getCombinedG2(prev_term, candidateTerm)
 		
 		# get next term
 		if position < len(term_list):
 			next_term = term_list[position]
-			if (next_term, candidateTerm) in self.similarity.combined_g2:
-				postBond = self.similarity.combined_g2[(candidateTerm, next_term)]
+			postBond = self.similarity.getCombinedG2(candidateTerm, next_term)
 		
 		return 2*(prevBond + postBond - currentBuffer)
 
+#-------------------------------------------------------------------------------#
+# Helper Functions (terms indexed by their position in the saliency ordering)
+	
+	def indexSimilarity( self, numSeriatedTerms ):
+		"""
+		Collect the combined similarity scores between all terms as sparse rows and columns over term IDs,
+		and as a dense sub-matrix for the terms that are ranked high enough to ever be seriated.
+		"""
+		terms = self.orderedTermList
+		termCount = len( terms )
+		self.termRanks = numpy.array( [ self.termRank[term] for term in terms ], dtype = numpy.int64 )
+		self.initialEnergies = numpy.array( [ 0.001 * self.termFreqs[term] * self.termSaliency[term] for term in terms ], dtype = numpy.float64 )
+		
+		if self.similarity.combined_g2_data is not None:
+			globalIDs = numpy.array( [ self.similarity.term_ids.get( term, -1 ) for term in terms ], dtype = numpy.int64 )
+			present = numpy.flatnonzero( globalIDs >= 0 )
+			size = len( self.similarity.term_index )
+			matrix = scipy.sparse.csr_matrix( ( self.similarity.combined_g2_data, self.similarity.combined_g2_indices, self.similarity.combined_g2_indptr ), shape = ( size, size ) )
+			matrix = matrix[ globalIDs[ present ] ][ :, globalIDs[ present ] ].tocoo()
+			( rows, columns, values ) = ( present[ matrix.row ], present[ matrix.col ], matrix.data )
+		else:
+			termIDs = { term : termID for termID, term in enumerate( terms ) }
+			entries = [ ( termIDs[ firstTerm ], termIDs[ secondTerm ], score ) for ( firstTerm, secondTerm ), score in self.similarity.combined_g2.iteritems() if firstTerm in termIDs and secondTerm in termIDs ]
+			rows = numpy.array( [ entry[0] for entry in entries ], dtype = numpy.int64 )
+			columns = numpy.array( [ entry[1] for entry in entries ], dtype = numpy.int64 )
+			values = numpy.array( [ entry[2] for entry in entries ], dtype = numpy.float64 )
+		self.similarityRows = scipy.sparse.csr_matrix( ( values, ( rows, columns ) ), shape = ( termCount, termCount ) )
+		self.similarityColumns = self.similarityRows.T.tocsr()
+		
+		poolIDs = numpy.flatnonzero( self.termRanks <= numSeriatedTerms + self.candidateSize )
+		self.poolIndex = numpy.full( termCount, -1, dtype = numpy.int64 )
+		self.poolIndex[ poolIDs ] = numpy.arange( len( poolIDs ) )
+		self.poolSimilarity = self.similarityRows[ poolIDs ][ :, poolIDs ].toarray()
+	
+	def getSimilarity( self, firstID, secondID ):
+		"""Return the combined similarity score between two terms that can be seriated."""
+		return self.poolSimilarity[ self.poolIndex[firstID], self.poolIndex[secondID] ]
+	
+	def getSimilarityVector( self, matrix, termID ):
+		"""Return a row of a sparse matrix as a dense vector."""
+		vector = numpy.zeros( matrix.shape[1], dtype = numpy.float64 )
+		start = matrix.indptr[termID]
+		end = matrix.indptr[termID+1]
+		vector[ matrix.indices[start:end] ] = matrix.data[start:end]
+		return vector
+	
+	def initBestEnergiesByID(self, firstID):
+		"""
+		Keep the best energies of the remaining candidates in a heap keyed by ( -energy, termID ).
+		Best energies only increase, so an entry is stale once its energy differs from the current one
+		(or its term has been seriated); stale entries are skipped when popped rather than removed.
+		"""
+		self.preBest = self.getSimilarityVector(self.similarityColumns, firstID)
+		self.postBest = self.getSimilarityVector(self.similarityRows, firstID)
+		self.buildBestCandidates()
+	
+	def buildBestCandidates(self):
+		self.energies = self.preBest + self.postBest
+		candidateIDs = numpy.flatnonzero(self.active)
+		self.heap = zip((-self.energies[candidateIDs]).tolist(), candidateIDs.tolist())
+		heapq.heapify(self.heap)
+	
+	def updateBestEnergiesByID(self, addedID):
+		"""Update the best energies of the candidates similar to the newly added term."""
+		changed = set()
+		for (matrix, best) in ((self.similarityColumns, self.preBest), (self.similarityRows, self.postBest)):
+			start = matrix.indptr[addedID]
+			end = matrix.indptr[addedID+1]
+			termIDs = matrix.indices[start:end]
+			scores = matrix.data[start:end]
+			improved = scores > best[termIDs]
+			best[termIDs[improved]] = scores[improved]
+			changed.update(termIDs[improved].tolist())
+		for termID in changed:
+			if self.active[termID]:
+				self.energies[termID] = self.preBest[termID] + self.postBest[termID]
+				heapq.heappush(self.heap, (-self.energies[termID], termID))
+	
+	def popBestCandidates(self):
+		"""Yield the remaining candidates and their best energies, highest first (ties in saliency order), popping them off the heap."""
+		while len(self.heap) > 0:
+			entry = heapq.heappop(self.heap)
+			(negativeEnergy, termID) = entry
+			if self.active[termID] and -negativeEnergy == self.energies[termID]:
+				self.popped.append(entry)
+				yield (termID, -negativeEnergy)
+	
+	def restoreBestCandidates(self):
+		"""Push the candidates popped during an iteration back onto the heap, except the seriated term."""
+		for entry in self.popped:
+			if self.active[entry[1]]:
+				heapq.heappush(self.heap, entry)
+		self.popped = []
+	
+	def iterateByID(self, candidates, iteration_no):
+		term_ordering = self.term_ordering
+		buffers = self.buffers
+		candidateCount = len(self.orderedTermList) - len(term_ordering)
+		orderPool = self.poolIndex[term_ordering]
+		positionBuffers = numpy.array(buffers[:len(term_ordering)+1], dtype = numpy.float64)
+		current_buffer = buffers[len(term_ordering)]
+		maxEnergyChange = 0.0;
+		maxID = -1;
+		maxPosition = 0;
+		
+		# Evaluate candidates in batches of increasing size, as if one at a time in order:
+		# a candidate only replaces the best so far if strictly better, and the scan stops
+		# after the first candidate at which the best so far reaches twice its best energy.
+		breakout_counter = 0
+		breakout = False
+		batchSize = ComputeSeriation.CANDIDATE_BATCH_SIZE
+		while breakout_counter < candidateCount:
+			batch = list(itertools.islice(candidates, batchSize))
+			if len(batch) == 0:
+				break
+			candidateIDs = numpy.array([candidate for (candidate, bestEnergy) in batch], dtype = numpy.int64)
+			changes = self.getEnergyChangesByID(candidateIDs, orderPool, positionBuffers, iteration_no)
+			positions = changes.argmax(axis = 1)
+			candidateMax = changes[numpy.arange(len(batch)), positions]
+			
+			end = len(batch)
+			if batch[0][1] is not None:
+				bestEnergies = numpy.array([bestEnergy for (candidate, bestEnergy) in batch], dtype = numpy.float64)
+				runningMax = numpy.maximum.accumulate(numpy.maximum(candidateMax, maxEnergyChange))
+				candidateIndexes = breakout_counter + numpy.arange(len(batch))
+				stops = numpy.flatnonzero((runningMax >= 2*(bestEnergies + current_buffer)) & (candidateIndexes < candidateCount-1))
+				if len(stops) > 0:
+					end = stops[0] + 1
+					breakout = True
+			
+			best = candidateMax[:end].argmax()
+			if candidateMax[best] > maxEnergyChange:
+				maxEnergyChange = float(candidateMax[best])
+				maxID = int(candidateIDs[best])
+				maxPosition = int(positions[best])
+			breakout_counter += end
+			
+			# check for early termination
+			if breakout:
+				break;
+			batchSize *= 2
+		
+		self.recordIteration(breakout_counter, breakout)
+		self.logger.debug("Iteration %d: candidates checked = %d, change in energy = %s, maxTerm = %s, maxPosition = %d", iteration_no, breakout_counter, maxEnergyChange, self.orderedTermList[maxID] if maxID >= 0 else "", maxPosition)
+		
+		if maxID < 0:
+			return
+		self.active[maxID] = False
+		
+		# update buffers
+		if len(term_ordering) == 0:
+			pass
+		elif maxPosition >= len(term_ordering):
+			buffers.insert(len(buffers)-1, self.getSimilarity(term_ordering[-1], maxID))
+		elif maxPosition == 0:
+			buffers.insert(1, self.getSimilarity(maxID, term_ordering[0]))
+		else:
+			buffers[maxPosition] = self.getSimilarity(term_ordering[maxPosition-1], maxID)
+			buffers.insert(maxPosition+1, self.getSimilarity(maxID, term_ordering[maxPosition]))
+		
+		# update term ordering and ranking
+		term_ordering.insert(maxPosition, maxID)
+		self.term_iter_index.append(maxID)
+	
+	def getEnergyChangesByID(self, candidateIDs, orderPool, positionBuffers, iteration_no):
+		"""
+		Return the energy change of inserting each candidate at each position of the current ordering,
+		as a candidates x positions matrix; -inf for candidates that are not ranked high enough to be seriated yet.
+		"""
+		positionCount = len(orderPool) + 1
+		changes = numpy.empty((len(candidateIDs), positionCount), dtype = numpy.float64)
+		changes.fill(-numpy.inf)
+		eligible = self.termRanks[candidateIDs] <= (len(orderPool) + self.candidateSize)
+		
+		# first iteration only
+		if iteration_no == 0:
+			changes[eligible] = self.initialEnergies[candidateIDs[eligible]][:, numpy.newaxis]
+			return changes
+		
+		candidatePool = self.poolIndex[candidateIDs[eligible]]
+		prevBonds = numpy.zeros((len(candidatePool), positionCount), dtype = numpy.float64)
+		postBonds = numpy.zeros((len(candidatePool), positionCount), dtype = numpy.float64)
+		prevBonds[:, 1:] = self.poolSimilarity[numpy.ix_(orderPool, candidatePool)].T
+		postBonds[:, :-1] = self.poolSimilarity[numpy.ix_(candidatePool, orderPool)]
+		changes[eligible] = 2*(prevBonds + postBonds - positionBuffers)
+		return changes
+
 #-------------------------------------------------------------------------------#
 
 def main():
@@ -272,11 +653,18 @@ def main():
 	parser.add_argument( 'config_file'               , type = str, default = None                   , help = 'Path of Termite configuration file.'      )
 	parser.add_argument( '--data-path'               , type = str, dest = 'data_path'               , help = 'Override data path.'                      )
 	parser.add_argument( '--number-of-seriated-terms', type = int, dest = 'number_of_seriated_terms', help = 'Override the number of terms to seriate.' )
+	parser.add_argument( '--resume'                  , action = 'store_true', dest = 'resume'       , help = 'Resume (or extend) seriation from the last checkpoint.' )
+	parser.add_argument( '--checkpoint-interval'     , type = int, dest = 'checkpoint_interval'     , help = 'Override the number of iterations between checkpoints (0 to only checkpoint at the end).' )
+	parser.add_argument( '--progress-interval'       , type = int, dest = 'progress_interval'       , help = 'Override the number of iterations between progress reports (0 to only report at the end).' )
+	parser.add_argument( '--metrics-file'            , type = str, dest = 'metrics_file'            , help = 'Write progress metrics to this JSON file.' )
 	parser.add_argument( '--logging'                 , type = int, dest = 'logging'                 , help = 'Override logging level.'                  )
 	args = parser.parse_args()
 	
 	data_path = None
 	number_of_seriated_terms = None
+	checkpoint_interval = None
+	progress_interval = None
+	metrics_file = None
 	logging_level = 20
 	
 	# Read in default values from the configuration file
@@ -287,6 +675,12 @@ def main():
 			data_path = config.get( 'Termite', 'path' )
 		if config.has_section( 'Termite' ) and config.has_option( 'Termite', 'number_of_seriated_terms' ):
 			number_of_seriated_terms = config.getint( 'Termite', 'number_of_seriated_terms' )
+		if config.has_section( 'Termite' ) and config.has_option( 'Termite', 'seriation_checkpoint_interval' ):
+			checkpoint_interval = config.getint( 'Termite', 'seriation_checkpoint_interval' )
+		if config.has_section( 'Termite' ) and config.has_option( 'Termite', 'seriation_progress_interval' ):
+			progress_interval = config.getint( 'Termite', 'seriation_progress_interval' )
+		if config.has_section( 'Termite' ) and config.has_option( 'Termite', 'seriation_metrics_file' ):
+			metrics_file = config.get( 'Termite', 'seriation_metrics_file' )
 		if config.has_section( 'Misc' ) and config.has_option( 'Misc', 'logging' ):
 			logging_level = config.getint( 'Misc', 'logging' )
 	
@@ -295,10 +689,16 @@ def main():
 		data_path = args.data_path
 	if args.number_of_seriated_terms is not None:
 		number_of_seriated_terms = args.number_of_seriated_terms
+	if args.checkpoint_interval is not None:
+		checkpoint_interval = args.checkpoint_interval
+	if args.progress_interval is not None:
+		progress_interval = args.progress_interval
+	if args.metrics_file is not None:
+		metrics_file = args.metrics_file
 	if args.logging is not None:
 		logging_level = args.logging
 	
-	ComputeSeriation( logging_level ).execute( data_path, number_of_seriated_terms )
+	ComputeSeriation( logging_level ).execute( data_path, number_of_seriated_terms, args.resume, checkpoint_interval, progress_interval, metrics_file )
 
 if __name__ == '__main__':
 	main()
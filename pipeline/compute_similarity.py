@@ -7,8 +7,19 @@ import ConfigParser
 import logging
 
 import math
+import heapq
 import itertools
-from api_utils import TokensAPI, SimilarityAPI
+import multiprocessing
+from array import array
+from io_utils import ReadAsList
+from api_utils import TokensAPI, SaliencyAPI, SimilarityAPI
+
+try:
+	import numpy
+	import scipy.sparse
+except ImportError:
+	numpy = None
+	scipy = None
 
 class ComputeSimilarity( object ):
 	"""
@@ -16,19 +27,48 @@ class ComputeSimilarity( object ):
 	
 	Compute term similarity based on co-occurrence and
 	collocation likelihoods.
+	
+	Tokens are read from the integer-encoded token store when available,
+	and all counting is performed on token IDs. Terms are only decoded
+	when the combined similarity matrix is written out.
+	
+	All counts are collected in a single pass over the token stream, one
+	block of documents at a time. When numpy and scipy are available, counts
+	are kept as arrays indexed by token ID (occurrences) and as sparse matrices
+	over the vocabulary (co-occurrences), from counting through the likelihood
+	statistics, combining, and pruning; only the final matrix is converted into
+	a dict keyed by terms to be written out. Document co-occurrence is computed
+	from a sparse document-term incidence matrix X of each block as the product
+	X'X, and unigrams and bigrams are counted over the whole block at once.
+	Without numpy, all counts are dicts keyed by token IDs.
+	
+	With multiple workers, documents are split into shards that are counted
+	in a pool of processes; the partial counts are added to a running total as
+	they arrive, before computing the likelihood statistics.
+	
+	Counting can be restricted to a set of candidate terms: the top-ranked
+	terms by saliency, and/or an explicit list of terms. Only co-occurrences
+	between candidate terms are counted, but tokens of all other terms still
+	take up their positions in documents and windows, so the statistics for
+	every pair of candidate terms are identical to those of a full run.
 	"""
 	
 	DEFAULT_SLIDING_WINDOW_SIZE = 10
 	MAX_FREQ = 100.0
+	BLOCK_SIZE = 10000000  # Maximum number of tokens per block of documents
+	WINDOW_BUFFER_SIZE = 10000000  # Maximum number of buffered sliding-window co-occurrences
+	SHARDS_PER_WORKER = 4
 	
 	def __init__( self, logging_level ):
 		self.logger = logging.getLogger( 'ComputeSimilarity' )
 		self.logger.setLevel( logging_level )
-		handler = logging.StreamHandler( sys.stderr )
-		handler.setLevel( logging_level )
-		self.logger.addHandler( handler )
+		# Worker processes are forked with the logger (and its handler) already set up
+		if len( self.logger.handlers ) == 0:
+			handler = logging.StreamHandler( sys.stderr )
+			handler.setLevel( logging_level )
+			self.logger.addHandler( handler )
 	
-	def execute( self, data_path, sliding_window_size = None ):
+	def execute( self, data_path, sliding_window_size = None, number_of_candidate_terms = None, include_terms = None, workers = None, number_of_neighbors = None, minimum_g2 = None ):
 		
 		assert data_path is not None
 		if sliding_window_size is None:
@@ -38,22 +78,33 @@ class ComputeSimilarity( object ):
 		self.logger.info( 'Computing term similarity...'                                                     )
 		self.logger.info( '    data_path = %s', data_path                                                    )
 		self.logger.info( '    sliding_window_size = %d', sliding_window_size                                )
+		self.logger.info( '    number_of_candidate_terms = %s', number_of_candidate_terms                    )
+		self.logger.info( '    include_terms = %s', include_terms                                            )
+		self.logger.info( '    workers = %s', workers                                                        )
+		self.logger.info( '    number_of_neighbors = %s', number_of_neighbors                                )
+		self.logger.info( '    minimum_g2 = %s', minimum_g2                                                  )
 		
 		self.logger.info( 'Connecting to data...' )
+		self.data_path = data_path
 		self.tokens = TokensAPI( data_path )
+		self.saliency = SaliencyAPI( data_path )
 		self.similarity = SimilarityAPI( data_path )
 		
 		self.logger.info( 'Reading data from disk...' )
-		self.tokens.read()
-		
-		self.logger.info( 'Computing document co-occurrence...' )
-		self.computeDocumentCooccurrence()
+		if self.tokens.hasEncoded():
+			self.tokens.readEncoded()
+		elif numpy is not None:
+			self.tokens.encodeToDisk( self.tokens.iterate() )
+		else:
+			self.tokens.read()
+			self.tokens.encode()
+			self.tokens.data = {}
 		
-		self.logger.info( 'Computing sliding-window co-occurrence...' )
-		self.computeSlidingWindowCooccurrence( sliding_window_size )
+		if number_of_candidate_terms is not None:
+			self.saliency.read()
+		self.computeCandidateTerms( number_of_candidate_terms, include_terms )
 		
-		self.logger.info( 'Counting total number of tokens, unigrams, and bigrams in the corpus...' )
-		self.computeTokenCounts()
+		self.computeCounts( sliding_window_size, workers )
 		
 		self.logger.info( 'Computing document co-occurrence likelihood...' )
 		self.similarity.document_g2 = self.getG2Stats( self.document_count, self.similarity.document_occurrence, self.similarity.document_cooccurrence )
@@ -65,87 +116,322 @@ class ComputeSimilarity( object ):
 		self.similarity.collocation_g2 = self.getG2Stats( self.token_count, self.similarity.unigram_counts, self.similarity.bigram_counts )
 		
 		self.combineSimilarityMatrices()
+		self.pruneSimilarityMatrices( number_of_neighbors, minimum_g2 )
+		if numpy is not None:
+			self.encodeSimilarityMatrices()
+		self.decodeSimilarityMatrices()
 		
 		self.logger.info( 'Writing data to disk...' )
 		self.similarity.write()
 		
 		self.logger.info( '--------------------------------------------------------------------------------' )
 	
-	def incrementCount( self, occurrence, key ):
+	def incrementCount( self, occurrence, key, count = 1 ):
 		if key not in occurrence:
-			occurrence[ key ] = 1
+			occurrence[ key ] = count
+		else:
+			occurrence[ key ] += count
+	
+	def computeCandidateTerms( self, number_of_candidate_terms, include_terms ):
+		"""Collect the token IDs of all candidate terms, or None to count all terms."""
+		if number_of_candidate_terms is None and include_terms is None:
+			self.setCandidates( None )
+			return
+		
+		terms = set()
+		if number_of_candidate_terms is not None:
+			for element in self.saliency.term_info:
+				if element['rank'] < number_of_candidate_terms:
+					terms.add( element['term'] )
+		if include_terms is not None:
+			terms.update( ReadAsList( include_terms ) )
+		
+		termIDs = { term : termID for termID, term in enumerate( self.tokens.vocabulary ) }
+		self.setCandidates( frozenset( termIDs[term] for term in terms if term in termIDs ) )
+		self.logger.info( '    Restricting similarity to %d candidate terms', len( self.candidates ) )
+	
+	def setCandidates( self, candidates ):
+		self.candidates = candidates
+		self.candidateMask = None
+		if candidates is not None and numpy is not None:
+			self.candidateMask = numpy.zeros( len( self.tokens.vocabulary ), dtype = bool )
+			self.candidateMask[ list( candidates ) ] = True
+	
+	def computeCounts( self, sliding_window_size, workers ):
+		"""Count occurrences and co-occurrences in documents and in sliding windows, as well as unigrams and bigrams."""
+		self.logger.info( 'Counting document and sliding-window co-occurrence, unigrams, and bigrams...' )
+		if workers is not None and workers > 1 and numpy is not None:
+			counts = self.getCountsInParallel( sliding_window_size, workers )
+		else:
+			counts = self.getCounts( 0, len( self.tokens.document_index ), sliding_window_size )
+		
+		self.document_count = counts['document_count']
+		self.window_count = counts['window_count']
+		self.token_count = counts['token_count']
+		self.similarity.document_occurrence = counts['document_occurrence']
+		self.similarity.document_cooccurrence = counts['document_cooccurrence']
+		self.similarity.window_occurrence = counts['window_occurrence']
+		self.similarity.window_cooccurrence = counts['window_cooccurrence']
+		self.similarity.unigram_counts = counts['unigram_counts']
+		self.similarity.bigram_counts = counts['bigram_counts']
+	
+	def getCounts( self, start, end, sliding_window_size ):
+		"""
+		Return all counts for a range of documents, as a dict.
+		The token stream is traversed once, one block of documents at a time.
+		With numpy, counts are arrays and sparse matrices (see getSparseCounts);
+		otherwise all counts are updated in a single pass over the tokens of each document.
+		"""
+		if numpy is not None:
+			return self.getSparseCounts( start, end, sliding_window_size )
+		
+		offsets = self.tokens.document_offsets
+		counts = {
+			'document_count' : end - start,
+			'document_occurrence' : {},
+			'document_cooccurrence' : {},
+			'window_count' : 0,
+			'window_occurrence' : {},
+			'window_cooccurrence' : {},
+			'token_count' : int( offsets[end] - offsets[start] ),
+			'unigram_counts' : {},
+			'bigram_counts' : {}
+		}
+		for docID, docTokens in self.iterateDocuments( start, end ):
+			self.countDocument( counts, docTokens, sliding_window_size )
+		return counts
+	
+	def getSparseCounts( self, start, end, sliding_window_size ):
+		"""
+		Return all counts for a range of documents, as a dict of int64 arrays of length V (occurrences)
+		and V x V sparse CSR matrices (co-occurrences), where V is the size of the vocabulary.
+		Document co-occurrence, unigrams, and bigrams are counted for an entire block at once;
+		sliding windows are counted one document at a time into array buffers, which are summed
+		into the sparse matrix whenever they grow past WINDOW_BUFFER_SIZE.
+		"""
+		offsets = self.tokens.document_offsets
+		term_count = len( self.tokens.vocabulary )
+		counts = {
+			'document_count' : end - start,
+			'document_occurrence' : numpy.zeros( term_count, dtype = numpy.int64 ),
+			'document_cooccurrence' : scipy.sparse.csr_matrix( ( term_count, term_count ), dtype = numpy.int64 ),
+			'window_count' : int( offsets[end] - offsets[start] ) + 2 * sliding_window_size * ( end - start ),
+			'window_occurrence' : numpy.zeros( term_count, dtype = numpy.int64 ),
+			'window_cooccurrence' : scipy.sparse.csr_matrix( ( term_count, term_count ), dtype = numpy.int64 ),
+			'token_count' : int( offsets[end] - offsets[start] ),
+			'unigram_counts' : numpy.zeros( term_count, dtype = numpy.int64 ),
+			'bigram_counts' : scipy.sparse.csr_matrix( ( term_count, term_count ), dtype = numpy.int64 )
+		}
+		buffers = ( array( 'i' ), array( 'i' ), array( 'i' ), array( 'i' ), array( 'i' ) )
+		for ( blockStart, blockEnd ) in self.iterateDocumentBlocks( start, end ):
+			self.logger.debug( '    documents %d to %d', blockStart, blockEnd )
+			incidence = self.getIncidenceMatrix( blockStart, blockEnd )
+			counts['document_occurrence'] += numpy.bincount( incidence.indices, minlength = term_count )
+			counts['document_cooccurrence'] = counts['document_cooccurrence'] + scipy.sparse.triu( incidence.T * incidence, k = 1, format = 'csr' )
+			self.countTokens( counts, blockStart, blockEnd )
+			for docID, docTokens in self.iterateDocuments( blockStart, blockEnd ):
+				self.countWindows( buffers, docTokens, sliding_window_size )
+				if len( buffers[2] ) >= ComputeSimilarity.WINDOW_BUFFER_SIZE:
+					self.flushWindowCounts( counts, buffers )
+		self.flushWindowCounts( counts, buffers )
+		return counts
+	
+	def getCountsInParallel( self, sliding_window_size, workers ):
+		"""
+		Count shards of documents in a pool of processes.
+		Each worker returns its partial counts as arrays and sparse matrices, which are added to a running total as they arrive.
+		"""
+		shards = self.getShards( workers * ComputeSimilarity.SHARDS_PER_WORKER )
+		self.logger.info( 'Counting %d shards of documents using %d workers...', len( shards ), workers )
+		counts = self.getCounts( 0, 0, sliding_window_size )
+		pool = multiprocessing.Pool( workers, InitCountWorker, ( self.data_path, self.logger.level, self.candidates ) )
+		try:
+			for partialCounts in pool.imap_unordered( CountShard, [ ( start, end, sliding_window_size ) for ( start, end ) in shards ] ):
+				self.addCounts( counts, partialCounts )
+		finally:
+			pool.close()
+			pool.join()
+		return counts
+	
+	def addCounts( self, counts, partialCounts ):
+		"""Add partial counts returned by getSparseCounts to a running total."""
+		for key, value in partialCounts.iteritems():
+			counts[ key ] = counts[ key ] + value
+	
+	def getShards( self, count ):
+		"""Split the documents into (at most) count ranges with roughly equal numbers of tokens."""
+		offsets = self.tokens.document_offsets
+		targets = numpy.linspace( 0, offsets[-1], count + 1 )
+		bounds = numpy.searchsorted( offsets, targets, side = 'left' ).tolist()
+		bounds[0] = 0
+		bounds[-1] = len( offsets ) - 1
+		return [ ( start, end ) for ( start, end ) in zip( bounds[:-1], bounds[1:] ) if start < end ]
+	
+	def iterateDocuments( self, start, end ):
+		for docID, tokenIDs in self.tokens.iterateEncoded( start, end ):
+			yield docID, tokenIDs.tolist()
+	
+	def iterateDocumentBlocks( self, start, end ):
+		"""Yield ( start, end ) ranges of documents, each containing at most BLOCK_SIZE tokens (or a single document)."""
+		if numpy is None:
+			yield start, end
+			return
+		offsets = self.tokens.document_offsets
+		while start < end:
+			blockEnd = int( numpy.searchsorted( offsets, offsets[start] + ComputeSimilarity.BLOCK_SIZE, side = 'right' ) ) - 1
+			blockEnd = min( max( blockEnd, start + 1 ), end )
+			yield start, blockEnd
+			start = blockEnd
+	
+	def getIncidenceMatrix( self, start, end ):
+		"""Return a binary document-term matrix (CSR) for a range of documents."""
+		offsets = numpy.asarray( self.tokens.document_offsets[ start : end+1 ] )
+		tokenIDs = numpy.asarray( self.tokens.token_ids[ offsets[0] : offsets[-1] ] )
+		rows = numpy.repeat( numpy.arange( end - start ), numpy.diff( offsets ) )
+		if self.candidateMask is not None:
+			keep = self.candidateMask[ tokenIDs ]
+			tokenIDs = tokenIDs[ keep ]
+			rows = rows[ keep ]
+		values = numpy.ones( len( tokenIDs ), dtype = numpy.int64 )
+		incidence = scipy.sparse.csr_matrix( ( values, ( rows, tokenIDs ) ), shape = ( end - start, len( self.tokens.vocabulary ) ) )
+		incidence.sum_duplicates()
+		incidence.data.fill( 1 )
+		return incidence
+	
+	def countTokens( self, counts, start, end ):
+		"""Count unigrams and bigrams of candidate terms for a block of documents. Bigrams do not span documents."""
+		term_count = len( self.tokens.vocabulary )
+		offsets = numpy.asarray( self.tokens.document_offsets[ start : end+1 ] )
+		tokenIDs = numpy.asarray( self.tokens.token_ids[ offsets[0] : offsets[-1] ] )
+		if self.candidateMask is not None:
+			isCandidate = self.candidateMask[ tokenIDs ]
 		else:
-			occurrence[ key ] += 1
-	
-	def computeDocumentCooccurrence( self ):
-		document_count = 0
-		occurrence = {}
-		cooccurrence = {}
-		for docID, docTokens in self.tokens.data.iteritems():
-			self.logger.debug( '    %s (%d tokens)', docID, len(docTokens) )
-			tokenSet = frozenset(docTokens)
-			document_count += 1
-			for token in tokenSet:
-				self.incrementCount( occurrence, token )
-			for aToken in tokenSet:
-				for bToken in tokenSet:
-					if aToken < bToken:
-						self.incrementCount( cooccurrence, (aToken, bToken) )
-		
-		self.document_count = document_count
-		self.similarity.document_occurrence = occurrence
-		self.similarity.document_cooccurrence = cooccurrence
-	
-	def computeSlidingWindowCooccurrence( self, sliding_window_size ):
-		window_count = 0
-		occurrence = {}
-		cooccurrence = {}
-		for docID, docTokens in self.tokens.data.iteritems():
-			allWindowTokens = self.getSlidingWindowTokens( docTokens, sliding_window_size )
-			self.logger.debug( '    %s (%d tokens, %d windows)', docID, len(docTokens), len(allWindowTokens) )
-			for windowTokens in allWindowTokens:
-				tokenSet = frozenset(windowTokens)
-				window_count += 1
-				for token in tokenSet:
-					self.incrementCount( occurrence, token )
-				for aToken in tokenSet:
-					for bToken in tokenSet:
-						if aToken < bToken:
-							self.incrementCount( cooccurrence, (aToken, bToken) )
-		
-		self.window_count = window_count
-		self.similarity.window_occurrence = occurrence
-		self.similarity.window_cooccurrence = cooccurrence
-	
-	def getSlidingWindowTokens( self, tokens, sliding_window_size ):
-		allWindows = []
-		aIndex = 0 - sliding_window_size
-		bIndex = len(tokens) + sliding_window_size
-		for index in range( aIndex, bIndex ):
-			a = max( 0           , index - sliding_window_size )
-			b = min( len(tokens) , index + sliding_window_size )
-			allWindows.append( tokens[a:b] )
-		return allWindows
-	
-	def computeTokenCounts( self ):
-		token_count = sum( len(docTokens) for docTokens in self.tokens.data.itervalues() )
-		
-		unigram_counts = {}
-		for docTokens in self.tokens.data.itervalues():
-			for token in docTokens:
-				self.incrementCount( unigram_counts, token )
-		
-		bigram_counts = {}
-		for docTokens in self.tokens.data.itervalues():
-			prevToken = None
-			for currToken in docTokens:
-				if prevToken is not None:
-					self.incrementCount( bigram_counts, (prevToken, currToken) )
-				prevToken = currToken
-		
-		self.token_count = token_count
-		self.similarity.unigram_counts = unigram_counts
-		self.similarity.bigram_counts = bigram_counts
+			isCandidate = numpy.ones( len( tokenIDs ), dtype = bool )
+		counts['unigram_counts'] += numpy.bincount( tokenIDs[ isCandidate ], minlength = term_count )
+		
+		follows = isCandidate[:-1] & isCandidate[1:]
+		documentStarts = offsets[1:-1] - offsets[0]
+		documentStarts = documentStarts[ ( documentStarts > 0 ) & ( documentStarts < len( tokenIDs ) ) ]
+		follows[ documentStarts - 1 ] = False
+		values = numpy.ones( numpy.count_nonzero( follows ), dtype = numpy.int64 )
+		bigrams = scipy.sparse.csr_matrix( ( values, ( tokenIDs[:-1][ follows ], tokenIDs[1:][ follows ] ) ), shape = ( term_count, term_count ) )
+		counts['bigram_counts'] = counts['bigram_counts'] + bigrams
+	
+	def countWindows( self, buffers, tokens, sliding_window_size ):
+		"""
+		Same sliding-window sweep as countDocument, appending window occurrences as ( token, count )
+		and window co-occurrences as ( firstToken, secondToken, count ) to array buffers.
+		"""
+		candidates = self.candidates
+		( occurrenceTokens, occurrenceCounts, firstTokens, secondTokens, pairCounts ) = buffers
+		
+		span = 2 * sliding_window_size
+		multiplicity = {}
+		entered = {}
+		for window in range( 1, len(tokens) + span + 1 ):
+			if window <= len(tokens):
+				token = tokens[ window - 1 ]
+				if candidates is None or token in candidates:
+					if token in multiplicity:
+						multiplicity[ token ] += 1
+					else:
+						multiplicity[ token ] = 1
+						entered[ token ] = window
+			if 0 <= window - span - 1 < len(tokens):
+				token = tokens[ window - span - 1 ]
+				if candidates is None or token in candidates:
+					multiplicity[ token ] -= 1
+					if multiplicity[ token ] == 0:
+						del multiplicity[ token ]
+						start = entered.pop( token )
+						occurrenceTokens.append( token )
+						occurrenceCounts.append( window - start )
+						for otherToken, otherStart in entered.iteritems():
+							count = window - max( start, otherStart )
+							if count > 0:
+								firstTokens.append( min( token, otherToken ) )
+								secondTokens.append( max( token, otherToken ) )
+								pairCounts.append( count )
+	
+	def flushWindowCounts( self, counts, buffers ):
+		"""Add the window occurrences and co-occurrences collected by countWindows to the counts, and empty the buffers."""
+		term_count = len( self.tokens.vocabulary )
+		( occurrenceTokens, occurrenceCounts, firstTokens, secondTokens, pairCounts ) = [ numpy.frombuffer( buffer, dtype = numpy.int32 ) if len( buffer ) > 0 else numpy.zeros( 0, dtype = numpy.int32 ) for buffer in buffers ]
+		weights = numpy.bincount( occurrenceTokens, weights = occurrenceCounts, minlength = term_count )
+		counts['window_occurrence'] += weights.astype( numpy.int64 )
+		pairs = scipy.sparse.csr_matrix( ( pairCounts.astype( numpy.int64 ), ( firstTokens, secondTokens ) ), shape = ( term_count, term_count ) )
+		counts['window_cooccurrence'] = counts['window_cooccurrence'] + pairs
+		for buffer in buffers:
+			del buffer[:]
+	
+	def countDocument( self, counts, tokens, sliding_window_size ):
+		"""
+		Update all counts with one document, in a single pass over its tokens.
+		
+		Sliding windows are counted without materializing the windows.
+		There are len(tokens) + 2 * sliding_window_size windows; window j contains the
+		tokens at positions j - 2 * sliding_window_size to j - 1. Moving from one window
+		to the next adds at most one token and removes at most one token. A multiset of
+		the terms in the current window tracks when each term entered the window. When a
+		term leaves, its window occurrence grows by the number of windows it was present
+		in, and each pair it forms with a term still in the window grows by the number of
+		windows in which both were present.
+		
+		Unigrams, bigrams, and the set of distinct terms in the document are collected
+		as each token enters the window.
+		"""
+		candidates = self.candidates
+		window_occurrence = counts['window_occurrence']
+		window_cooccurrence = counts['window_cooccurrence']
+		unigram_counts = counts['unigram_counts']
+		bigram_counts = counts['bigram_counts']
+		tokenSet = set()
+		
+		span = 2 * sliding_window_size
+		multiplicity = {}
+		entered = {}
+		prevToken = None
+		prevIsCandidate = False
+		for window in range( len(tokens) + span + 1 ):
+			if 0 < window <= len(tokens):
+				token = tokens[ window - 1 ]
+				isCandidate = candidates is None or token in candidates
+				if isCandidate:
+					self.incrementCount( unigram_counts, token )
+					if prevIsCandidate:
+						self.incrementCount( bigram_counts, (prevToken, token) )
+					tokenSet.add( token )
+					if token in multiplicity:
+						multiplicity[ token ] += 1
+					else:
+						multiplicity[ token ] = 1
+						entered[ token ] = window
+				prevToken = token
+				prevIsCandidate = isCandidate
+			if 0 <= window - span - 1 < len(tokens):
+				token = tokens[ window - span - 1 ]
+				if candidates is None or token in candidates:
+					multiplicity[ token ] -= 1
+					if multiplicity[ token ] == 0:
+						del multiplicity[ token ]
+						start = entered.pop( token )
+						self.incrementCount( window_occurrence, token, window - start )
+						for otherToken, otherStart in entered.iteritems():
+							count = window - max( start, otherStart )
+							if count > 0:
+								if token < otherToken:
+									self.incrementCount( window_cooccurrence, (token, otherToken), count )
+								else:
+									self.incrementCount( window_cooccurrence, (otherToken, token), count )
+		counts['window_count'] += len(tokens) + span
+		
+		document_occurrence = counts['document_occurrence']
+		document_cooccurrence = counts['document_cooccurrence']
+		for aToken in tokenSet:
+			self.incrementCount( document_occurrence, aToken )
+			for bToken in tokenSet:
+				if aToken < bToken:
+					self.incrementCount( document_cooccurrence, (aToken, bToken) )
 	
 	def getBinomial( self, B_given_A, any_given_A, B_given_notA, any_given_notA ):
 		assert B_given_A >= 0
@@ -186,6 +472,9 @@ class ComputeSimilarity( object ):
 		return self.getBinomial( B_given_A, any_given_A, B_given_notA, any_given_notA )
 	
 	def getG2Stats( self, max_count, occurrence, cooccurrence ):
+		if numpy is not None:
+			return self.getG2StatsVectorized( max_count, occurrence, cooccurrence )
+		
 		g2_stats = {}
 		freq_all = max_count
 		for ( firstToken, secondToken ) in cooccurrence:
@@ -202,8 +491,52 @@ class ComputeSimilarity( object ):
 				g2_stats[ (firstToken, secondToken) ] = self.getG2( freq_all, freq_ab, freq_a, freq_b )
 		return g2_stats
 	
+	def getG2StatsVectorized( self, max_count, occurrence, cooccurrence ):
+		"""
+		Same as getG2Stats, with the rescaling filter and G2 computed for all pairs at once as array operations.
+		Occurrences are an array indexed by token ID and co-occurrences a sparse matrix; returns a sparse matrix of G2 statistics.
+		"""
+		term_count = len( self.tokens.vocabulary )
+		cooccurrence = cooccurrence.tocoo()
+		if max_count == 0 or cooccurrence.nnz == 0:
+			return scipy.sparse.csr_matrix( ( term_count, term_count ), dtype = numpy.float64 )
+		freq_all = float( max_count )
+		freq_a = occurrence[ cooccurrence.row ].astype( numpy.float64 )
+		freq_b = occurrence[ cooccurrence.col ].astype( numpy.float64 )
+		
+		scale = ComputeSimilarity.MAX_FREQ / max_count
+		keep = ( freq_a * scale > 1.0 ) & ( freq_b * scale > 1.0 )
+		g2 = self.getG2Vectorized( freq_all, cooccurrence.data[ keep ].astype( numpy.float64 ), freq_a[ keep ], freq_b[ keep ] )
+		return scipy.sparse.csr_matrix( ( g2, ( cooccurrence.row[ keep ], cooccurrence.col[ keep ] ) ), shape = ( term_count, term_count ) )
+	
+	def getG2Vectorized( self, freq_all, freq_ab, freq_a, freq_b ):
+		"""Same as getG2 and getBinomial, over arrays of counts."""
+		assert ( freq_all >= freq_a ).all()
+		assert ( freq_all >= freq_b ).all()
+		assert ( freq_a >= freq_ab ).all()
+		assert ( freq_b >= freq_ab ).all()
+		assert freq_all >= 0
+		assert ( freq_ab >= 0 ).all()
+		assert ( freq_all - freq_a >= freq_b - freq_ab ).all()
+		
+		a = freq_ab
+		b = freq_b - freq_ab
+		c = freq_a
+		d = freq_all - freq_a
+		E1 = c * ( a + b ) / ( c + d )
+		E2 = d * ( a + b ) / ( c + d )
+		
+		with numpy.errstate( divide = 'ignore', invalid = 'ignore' ):
+			g2a = numpy.where( a > 0, a * numpy.log( a / E1 ), 0.0 )
+			g2b = numpy.where( b > 0, b * numpy.log( b / E2 ), 0.0 )
+		return 2 * ( g2a + g2b )
+	
 	def combineSimilarityMatrices( self ):
 		self.logger.info( 'Combining similarity matrices...' )
+		if numpy is not None:
+			self.combineSimilarityMatricesSparse()
+			return
+		
 		self.similarity.combined_g2 = {}
 		
 		keys_queued = []
@@ -242,6 +575,87 @@ class ComputeSimilarity( object ):
 					score += self.similarity.collocation_g2[ key ]
 				if score > 0.0:
 					self.similarity.combined_g2[ key ] = score
+	
+	def combineSimilarityMatricesSparse( self ):
+		"""
+		Same as combineSimilarityMatrices, as a sparse matrix addition.
+		Document and window G2 are upper-triangular (ordered token pairs) and apply in both directions; collocation G2 is directed.
+		"""
+		symmetric = self.similarity.document_g2 + self.similarity.window_g2
+		symmetric = symmetric + scipy.sparse.triu( symmetric, k = 1 ).T
+		combined = ( symmetric + self.similarity.collocation_g2 ).tocsr()
+		combined.data[ ~( combined.data > 0.0 ) ] = 0.0
+		combined.eliminate_zeros()
+		self.similarity.combined_g2 = combined
+	
+	def pruneSimilarityMatrices( self, number_of_neighbors, minimum_g2 ):
+		"""Keep only the top number_of_neighbors terms by G2 for each term, and/or only scores of at least minimum_g2."""
+		if number_of_neighbors is None and minimum_g2 is None:
+			return
+		
+		self.logger.info( 'Pruning combined similarity matrix...' )
+		combined_g2 = self.similarity.combined_g2
+		if numpy is not None:
+			combined_g2 = combined_g2.tocoo()
+			( rows, columns, values ) = ( combined_g2.row, combined_g2.col, combined_g2.data )
+			if minimum_g2 is not None:
+				keep = values >= minimum_g2
+				( rows, columns, values ) = ( rows[ keep ], columns[ keep ], values[ keep ] )
+			if number_of_neighbors is not None:
+				order = numpy.lexsort( ( columns, -values, rows ) )
+				( rows, columns, values ) = ( rows[ order ], columns[ order ], values[ order ] )
+				rowStarts = numpy.searchsorted( rows, rows, side = 'left' )
+				keep = numpy.arange( len( rows ) ) - rowStarts < number_of_neighbors
+				( rows, columns, values ) = ( rows[ keep ], columns[ keep ], values[ keep ] )
+			self.similarity.combined_g2 = scipy.sparse.csr_matrix( ( values, ( rows, columns ) ), shape = combined_g2.shape )
+			self.logger.info( '    Kept %d similarity scores', self.similarity.combined_g2.nnz )
+		else:
+			if minimum_g2 is not None:
+				combined_g2 = { key : value for key, value in combined_g2.iteritems() if value >= minimum_g2 }
+			if number_of_neighbors is not None:
+				neighbors = {}
+				for ( firstToken, secondToken ), value in combined_g2.iteritems():
+					if firstToken not in neighbors:
+						neighbors[ firstToken ] = []
+					neighbors[ firstToken ].append( ( value, -secondToken ) )
+				combined_g2 = {}
+				for firstToken, values in neighbors.iteritems():
+					for ( value, secondToken ) in heapq.nlargest( number_of_neighbors, values ):
+						combined_g2[ ( firstToken, -secondToken ) ] = value
+			self.similarity.combined_g2 = combined_g2
+			self.logger.info( '    Kept %d similarity scores', len( self.similarity.combined_g2 ) )
+	
+	def encodeSimilarityMatrices( self ):
+		"""Store the combined similarity matrix in CSR form over the vocabulary, to be written alongside the text file."""
+		matrix = self.similarity.combined_g2
+		matrix.sort_indices()
+		self.similarity.setEncoded( self.tokens.vocabulary, matrix.indptr, matrix.indices, matrix.data )
+	
+	def decodeSimilarityMatrices( self ):
+		"""Replace token IDs with terms in the combined similarity matrix, converting it into a dict to be written out."""
+		vocabulary = self.tokens.vocabulary
+		if numpy is not None:
+			combined_g2 = self.similarity.combined_g2.tocoo()
+			self.similarity.combined_g2 = { ( vocabulary[ firstToken ], vocabulary[ secondToken ] ) : score for ( firstToken, secondToken, score ) in itertools.izip( combined_g2.row.tolist(), combined_g2.col.tolist(), combined_g2.data.tolist() ) }
+			return
+		self.similarity.combined_g2 = { ( vocabulary[ firstToken ], vocabulary[ secondToken ] ) : score for ( firstToken, secondToken ), score in self.similarity.combined_g2.iteritems() }
+
+#-------------------------------------------------------------------------------#
+# Worker processes for counting in parallel
+
+worker = None
+
+def InitCountWorker( data_path, logging_level, candidates ):
+	global worker
+	worker = ComputeSimilarity( logging_level )
+	worker.tokens = TokensAPI( data_path )
+	worker.tokens.readEncoded()
+	worker.setCandidates( candidates )
+
+def CountShard( task ):
+	( start, end, sliding_window_size ) = task
+	worker.logger.debug( '    Counting documents %d to %d', start, end )
+	return worker.getCounts( start, end, sliding_window_size )
 
 #-------------------------------------------------------------------------------#
 
@@ -250,11 +664,21 @@ def main():
 	parser.add_argument( 'config_file'          , type = str, default = None              , help = 'Path of Termite configuration file.' )
 	parser.add_argument( '--data-path'          , type = str, dest = 'data_path'          , help = 'Override data path.'                 )
 	parser.add_argument( '--sliding-window-size', type = int, dest = 'sliding_window_size', help = 'Override sliding window size.'       )
+	parser.add_argument( '--number-of-candidate-terms', type = int, dest = 'number_of_candidate_terms', help = 'Only compute similarity between the top terms by saliency.' )
+	parser.add_argument( '--include-terms'      , type = str, dest = 'include_terms'      , help = 'Only compute similarity between terms listed in this file (one per line).' )
+	parser.add_argument( '--workers'            , type = int, dest = 'workers'            , help = 'Number of worker processes.'         )
+	parser.add_argument( '--number-of-neighbors', type = int, dest = 'number_of_neighbors', help = 'Only keep the most similar terms for each term.' )
+	parser.add_argument( '--minimum-g2'         , type = float, dest = 'minimum_g2'       , help = 'Only keep similarity scores of at least this value.' )
 	parser.add_argument( '--logging'            , type = int, dest = 'logging'            , help = 'Override logging level.'             )
 	args = parser.parse_args()
 	
 	data_path = None
 	sliding_window_size = None
+	number_of_candidate_terms = None
+	include_terms = None
+	workers = None
+	number_of_neighbors = None
+	minimum_g2 = None
 	logging_level = 20
 	
 	# Read in default values from the configuration file
@@ -264,7 +688,17 @@ def main():
 		if config.has_section( 'Termite' ) and config.has_option( 'Termite', 'path' ):
 			data_path = config.get( 'Termite', 'path' )
 		if config.has_section( 'Termite' ) and config.has_option( 'Termite', 'sliding_window_size' ):
-			sliding_window_size = config.get( 'Termite', 'sliding_window_size' )
+			sliding_window_size = config.getint( 'Termite', 'sliding_window_size' )
+		if config.has_section( 'Termite' ) and config.has_option( 'Termite', 'number_of_candidate_terms' ):
+			number_of_candidate_terms = config.getint( 'Termite', 'number_of_candidate_terms' )
+		if config.has_section( 'Termite' ) and config.has_option( 'Termite', 'include_terms' ):
+			include_terms = config.get( 'Termite', 'include_terms' )
+		if config.has_section( 'Termite' ) and config.has_option( 'Termite', 'number_of_neighbors' ):
+			number_of_neighbors = config.getint( 'Termite', 'number_of_neighbors' )
+		if config.has_section( 'Termite' ) and config.has_option( 'Termite', 'minimum_g2' ):
+			minimum_g2 = config.getfloat( 'Termite', 'minimum_g2' )
+		if config.has_section( 'Misc' ) and config.has_option( 'Misc', 'workers' ):
+			workers = config.getint( 'Misc', 'workers' )
 		if config.has_section( 'Misc' ) and config.has_option( 'Misc', 'logging' ):
 			logging_level = config.getint( 'Misc', 'logging' )
 	
@@ -273,10 +707,20 @@ def main():
 		data_path = args.data_path
 	if args.sliding_window_size is not None:
 		sliding_window_size = args.sliding_window_size
+	if args.number_of_candidate_terms is not None:
+		number_of_candidate_terms = args.number_of_candidate_terms
+	if args.include_terms is not None:
+		include_terms = args.include_terms
+	if args.workers is not None:
+		workers = args.workers
+	if args.number_of_neighbors is not None:
+		number_of_neighbors = args.number_of_neighbors
+	if args.minimum_g2 is not None:
+		minimum_g2 = args.minimum_g2
 	if args.logging is not None:
 		logging_level = args.logging
 	
-	ComputeSimilarity( logging_level ).execute( data_path, sliding_window_size )
+	ComputeSimilarity( logging_level ).execute( data_path, sliding_window_size, number_of_candidate_terms, include_terms, workers, number_of_neighbors, minimum_g2 )
 
 if __name__ == '__main__':
 	main()
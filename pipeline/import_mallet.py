@@ -1,13 +1,21 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import os
 import sys
 import argparse
 import ConfigParser
 import logging
 
-from utf8_utils import UnicodeReader
-from api_utils import ModelAPI
+import itertools
+from operator import itemgetter
+from array import array
+from api_utils import TokensAPI, ModelAPI
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
 
 class ImportMallet( object ):
 
@@ -17,6 +25,15 @@ class ImportMallet( object ):
 	
 	# Files generated by Mallet
 	TOPIC_WORD_WEIGHTS = 'topic-word-weights.txt'
+	WORD_TOPIC_COUNTS = 'word-topic-counts.txt'
+	TOPIC_KEYS = 'output-topic-keys.txt'
+	DOC_TOPICS = 'output-doc-topics.txt'
+	
+	# Import either the dense topic-word weights, or the sparse word-topic counts
+	# smoothed by the topic-word Dirichlet prior (Mallet's default beta)
+	IMPORT_WEIGHTS = 'weights'
+	IMPORT_COUNTS = 'counts'
+	DEFAULT_BETA = 0.01
 	
 	def __init__( self, logging_level ):
 		self.logger = logging.getLogger( 'ImportMallet' )
@@ -25,57 +42,107 @@ class ImportMallet( object ):
 		handler.setLevel( logging_level )
 		self.logger.addHandler( handler )
 	
-	def execute( self, model_library, model_path, data_path ):
+	def execute( self, model_library, model_path, data_path, import_format = None, beta = None, export_dense = False ):
 		
 		assert model_library is not None
 		assert model_library == 'mallet'
 		assert model_path is not None
 		assert data_path is not None
+		if import_format is None:
+			import_format = ImportMallet.IMPORT_WEIGHTS
+		assert import_format == ImportMallet.IMPORT_WEIGHTS or import_format == ImportMallet.IMPORT_COUNTS
+		if beta is None:
+			beta = ImportMallet.DEFAULT_BETA
 		
 		self.logger.info( '--------------------------------------------------------------------------------' )
 		self.logger.info( 'Importing a Mallet model...'                                                      )
 		self.logger.info( '    topic model = %s (%s)', model_path, model_library                             )
 		self.logger.info( '    output = %s', data_path                                                       )
+		self.logger.info( '    import_format = %s', import_format                                            )
 		
 		self.logger.info( 'Connecting to data...' )
 		self.model = ModelAPI( data_path )
 		
-		self.logger.info( 'Reading "%s" from Mallet...', ImportMallet.TOPIC_WORD_WEIGHTS )
-		self.extractTopicWordWeights( model_path )
+		if import_format == ImportMallet.IMPORT_COUNTS:
+			self.logger.info( 'Reading "%s" from Mallet...', ImportMallet.WORD_TOPIC_COUNTS )
+			self.extractWordTopicCounts( model_path, beta )
+		else:
+			self.logger.info( 'Reading "%s" from Mallet...', ImportMallet.TOPIC_WORD_WEIGHTS )
+			self.extractTopicWordWeights( model_path )
+		
+		if os.path.exists( '{}/{}'.format( model_path, ImportMallet.DOC_TOPICS ) ):
+			self.logger.info( 'Reading "%s" from Mallet...', ImportMallet.DOC_TOPICS )
+			( docIDs, docIDsFilename ) = self.getDocumentIDs( data_path )
+			self.extractDocumentTopicMatrix( model_path, docIDs, docIDsFilename )
+		else:
+			self.logger.info( 'No "%s" from Mallet; skipping the document-topic matrix', ImportMallet.DOC_TOPICS )
 		
 		self.logger.info( 'Writing data to disk...' )
-		self.model.write()
+		self.model.write( dense = export_dense )
 		
 		self.logger.info( '--------------------------------------------------------------------------------' )
 	
 	def extractTopicWordWeights( self, model_path ):
-		data = {}
-		words = []
-		topics = []
+		"""
+		Read the ( topic, word, weight ) entries from Mallet, which come in one block of lines per topic covering every word.
+		Words are interned while reading the first block, which fixes the rows of the term-topic matrix (in sorted term order).
+		Each block is collected into a single column buffer, and copied into the matrix as a whole topic column. With numpy and
+		a known number of topics (from the topic keys), the matrix is allocated once, after the first block; otherwise it is
+		built from the topic columns at the end. Words missing from a block have a weight of 0.
+		"""
+		topicCount = self.getTopicCount( model_path )
+		term_index = None
+		wordRows = None
+		matrix = None
+		topicColumns = {}
 		
-		# Read in content of file (sparse matrix representation)
 		filename = '{}/{}'.format( model_path, ImportMallet.TOPIC_WORD_WEIGHTS )
 		with open( filename, 'r' ) as f:
-			lines = UnicodeReader( f )
-			for (topic, word, value) in lines:
+			entries = ( line.rstrip( '\r\n' ).split( '\t' ) for line in f )
+			for ( topic, block ) in itertools.groupby( entries, key = itemgetter(0) ):
 				topic = int(topic)
-				if topic not in data:
-					data[ topic ] = {}
-				data[ topic ][ word ] = float(value)
-				words.append( word )
-				topics.append( topic )
-		
-		# Get list of terms and topic indexes
-		term_index = sorted( list( frozenset( words ) ) )
-		topic_index = sorted( list( frozenset( topics ) ) )
-		
-		# Build dense matrix representation
-		matrix = []
-		for term in term_index :
-			row = []
-			for topic in topic_index :
-				row.append( data[ topic ][ term ] )
-			matrix.append( row )
+				assert topic not in topicColumns, 'Topic {} is not in a single block of lines in {}'.format( topic, filename )
+				if wordRows is None:
+					words = []
+					weights = array( 'd' )
+					for (entryTopic, word, value) in block:
+						words.append( word )
+						weights.append( float(value) )
+					( term_index, wordRows ) = self.getTermRows( words )
+					column = array( 'd', [ 0.0 ] ) * len( term_index )
+					for ( word, value ) in itertools.izip( words, weights ):
+						column[ wordRows[ word ] ] = value
+					del words, weights
+				else:
+					column = array( 'd', [ 0.0 ] ) * len( term_index )
+					for (entryTopic, word, value) in block:
+						assert word in wordRows, 'Word "{}" of topic {} is missing from the first topic in {}'.format( word, topic, filename )
+						column[ wordRows[ word ] ] = float(value)
+				
+				if numpy is not None and topicCount is not None:
+					assert 0 <= topic < topicCount, 'Topic {} in {} is not listed in the topic keys'.format( topic, filename )
+					if matrix is None:
+						matrix = numpy.zeros( ( len( term_index ), topicCount ), dtype = numpy.float64 )
+					matrix[ :, topic ] = numpy.frombuffer( column, dtype = numpy.float64 )
+					topicColumns[ topic ] = None
+				else:
+					topicColumns[ topic ] = column
+		
+		if term_index is None:
+			term_index = []
+		if numpy is not None and topicCount is not None:
+			topic_index = range( topicCount )
+			if matrix is None:
+				matrix = numpy.zeros( ( 0, topicCount ), dtype = numpy.float64 )
+		else:
+			topic_index = sorted( topicColumns.iterkeys() )
+			if numpy is not None:
+				matrix = numpy.zeros( ( len( term_index ), len( topic_index ) ), dtype = numpy.float64 )
+				for column, topic in enumerate( topic_index ):
+					matrix[ :, column ] = numpy.frombuffer( topicColumns.pop( topic ), dtype = numpy.float64 )
+			else:
+				columns = [ topicColumns[ topic ] for topic in topic_index ]
+				matrix = [ [ column[row] for column in columns ] for row in range( len( term_index ) ) ]
 		
 		# Generate topic labels
 		topic_str_index = [ 'Topic {}'.format(d) for d in topic_index ]
@@ -83,6 +150,137 @@ class ImportMallet( object ):
 		self.model.term_topic_matrix = matrix
 		self.model.term_index = term_index
 		self.model.topic_index = topic_str_index
+	
+	def getTermRows( self, words ):
+		"""Return the sorted list of terms, and the row of each word (as read from Mallet, in UTF-8) in that order."""
+		terms = [ word.decode( 'utf-8' ) for word in words ]
+		order = sorted( range( len( terms ) ), key = terms.__getitem__ )
+		wordRows = {}
+		for row, wordID in enumerate( order ):
+			wordRows[ words[ wordID ] ] = row
+		return [ terms[ wordID ] for wordID in order ], wordRows
+	
+	def getTopicCount( self, model_path ):
+		"""Return the number of topics listed in the topic keys from Mallet, or None if there are none."""
+		filename = '{}/{}'.format( model_path, ImportMallet.TOPIC_KEYS )
+		if not os.path.exists( filename ):
+			return None
+		with open( filename, 'r' ) as f:
+			return sum( 1 for line in f if len( line.strip() ) > 0 )
+
+	def extractWordTopicCounts( self, model_path, beta ):
+		"""
+		Read the sparse per-word topic counts from Mallet (one line per word: 'id word topic:count ...')
+		into a sparse term-topic matrix; the smoothing (beta) is added to every cell when the model is written.
+		"""
+		words = []
+		wordOffsets = array( 'l', [ 0 ] )
+		wordTopics = array( 'l' )
+		wordCounts = array( 'd' )
+		topicCount = 0
+		
+		filename = '{}/{}'.format( model_path, ImportMallet.WORD_TOPIC_COUNTS )
+		with open( filename, 'r' ) as f:
+			for line in f:
+				fields = line.split()
+				words.append( fields[1].decode( 'utf-8' ) )
+				for field in fields[2:]:
+					(topic, count) = field.split( ':' )
+					topic = int(topic)
+					wordTopics.append( topic )
+					wordCounts.append( float(count) )
+					topicCount = max( topicCount, topic + 1 )
+				wordOffsets.append( len( wordTopics ) )
+		
+		# Topics without any counts only appear in the list of topic keys
+		keysTopicCount = self.getTopicCount( model_path )
+		if keysTopicCount is not None:
+			topicCount = max( topicCount, keysTopicCount )
+		
+		# Reorder the rows by term
+		order = sorted( range( len( words ) ), key = words.__getitem__ )
+		indptr = array( 'l', [ 0 ] )
+		indices = array( 'l' )
+		values = array( 'd' )
+		for wordID in order:
+			indices.extend( wordTopics[ wordOffsets[wordID] : wordOffsets[wordID+1] ] )
+			values.extend( wordCounts[ wordOffsets[wordID] : wordOffsets[wordID+1] ] )
+			indptr.append( len( indices ) )
+		
+		self.model.term_index = [ words[wordID] for wordID in order ]
+		self.model.topic_index = [ 'Topic {}'.format(d) for d in range( topicCount ) ]
+		self.model.setSparse( indptr, indices, values, beta )
+
+	def getDocumentIDs( self, data_path ):
+		"""
+		Return the document IDs of the tokens file that Mallet was trained on, in line order, and the file they were read from;
+		or ( None, None ) if there is none.
+		train_mallet.sh imports the document IDs as Mallet labels, so Mallet names the documents by line instead.
+		"""
+		tokens = TokensAPI( data_path )
+		if tokens.hasEncoded():
+			tokens.readEncoded()
+			return tokens.document_index, tokens.path + TokensAPI.DOCUMENT_INDEX
+		if os.path.exists( tokens.path + TokensAPI.TOKENS ):
+			return [ docID for ( docID, docTokens ) in tokens.iterate() ], tokens.path + TokensAPI.TOKENS
+		self.logger.info( 'No tokens found; using the document names from Mallet' )
+		return None, None
+	
+	def extractDocumentTopicMatrix( self, model_path, docIDs = None, docIDsFilename = None ):
+		"""
+		Read the topic mixture of each document from Mallet.
+		Each line holds a document number and name, followed by either ( topic, proportion ) pairs
+		(after a '#doc name topic proportion ...' header, as in Mallet 2.0.7) or the proportions of all topics in order.
+		Documents are identified by the docIDs at their document numbers if provided, or else by their Mallet names.
+		The docIDs (read from docIDsFilename) must match the documents from Mallet one to one.
+		"""
+		document_index = []
+		rows = array( 'l' )
+		columns = array( 'l' )
+		values = array( 'd' )
+		hasPairs = False
+		
+		filename = '{}/{}'.format( model_path, ImportMallet.DOC_TOPICS )
+		with open( filename, 'r' ) as f:
+			for line in f:
+				if line.startswith( '#' ):
+					hasPairs = True
+					continue
+				fields = line.split()
+				if len( fields ) == 0:
+					continue
+				row = len( document_index )
+				if docIDs is not None:
+					docNumber = int( fields[0] )
+					assert 0 <= docNumber < len( docIDs ), 'Document number {} in {} is out of range for the {} documents in {}'.format( docNumber, filename, len( docIDs ), docIDsFilename )
+					document_index.append( docIDs[ docNumber ] )
+				else:
+					document_index.append( fields[1].decode( 'utf-8' ) )
+				if hasPairs:
+					for k in range( 2, len( fields ) - 1, 2 ):
+						rows.append( row )
+						columns.append( int( fields[k] ) )
+						values.append( float( fields[k+1] ) )
+				else:
+					for topic, value in enumerate( fields[2:] ):
+						rows.append( row )
+						columns.append( topic )
+						values.append( float( value ) )
+		
+		if docIDs is not None:
+			assert len( document_index ) == len( docIDs ), '{} has {} documents, but {} has {}'.format( filename, len( document_index ), docIDsFilename, len( docIDs ) )
+		topicCount = len( self.model.topic_index )
+		assert len( columns ) == 0 or ( min( columns ) >= 0 and max( columns ) < topicCount )
+		if numpy is not None:
+			matrix = numpy.zeros( ( len( document_index ), topicCount ), dtype = numpy.float32 )
+			matrix[ numpy.frombuffer( rows, dtype = rows.typecode ), numpy.frombuffer( columns, dtype = columns.typecode ) ] = numpy.frombuffer( values, dtype = numpy.float64 )
+		else:
+			matrix = [ [ 0.0 ] * topicCount for document in document_index ]
+			for ( row, column, value ) in zip( rows, columns, values ):
+				matrix[ row ][ column ] = value
+		
+		self.model.document_index = document_index
+		self.model.document_topic_matrix = matrix
 
 def main():
 	parser = argparse.ArgumentParser( description = 'Import results from Mallet topic model library into Termite.' )
@@ -90,12 +288,18 @@ def main():
 	parser.add_argument( '--topic-model-library', type = str, dest = 'model_library', help = 'Override topic model library.'       )
 	parser.add_argument( '--topic-model-path'   , type = str, dest = 'model_path'   , help = 'Override topic model path.'          )
 	parser.add_argument( '--data-path'          , type = str, dest = 'data_path'    , help = 'Override data path.'                 )
+	parser.add_argument( '--mallet-import'      , type = str, dest = 'mallet_import', choices = [ ImportMallet.IMPORT_WEIGHTS, ImportMallet.IMPORT_COUNTS ], help = 'Override whether to import topic-word weights or word-topic counts.' )
+	parser.add_argument( '--mallet-beta'        , type = float, dest = 'mallet_beta', help = 'Override the topic-word smoothing added to word-topic counts.' )
+	parser.add_argument( '--mallet-export-dense', action = 'store_true', dest = 'mallet_export_dense', default = None, help = 'Also write word-topic counts as a dense text matrix.' )
 	parser.add_argument( '--logging'            , type = int, dest = 'logging'      , help = 'Override logging level.'             )
 	args = parser.parse_args()
 	
 	model_library = None
 	model_path = None
 	data_path = None
+	mallet_import = None
+	mallet_beta = None
+	mallet_export_dense = False
 	logging_level = 20
 	
 	# Read in default values from the configuration file
@@ -104,6 +308,12 @@ def main():
 	model_library = config.get( 'TopicModel', 'library' )
 	model_path = config.get( 'TopicModel', 'path' )
 	data_path = config.get( 'Termite', 'path' )
+	if config.has_option( 'TopicModel', 'mallet_import' ):
+		mallet_import = config.get( 'TopicModel', 'mallet_import' )
+	if config.has_option( 'TopicModel', 'mallet_beta' ):
+		mallet_beta = config.getfloat( 'TopicModel', 'mallet_beta' )
+	if config.has_option( 'TopicModel', 'mallet_export_dense' ):
+		mallet_export_dense = config.getboolean( 'TopicModel', 'mallet_export_dense' )
 	if config.has_section( 'Misc' ):
 		if config.has_option( 'Misc', 'logging' ):
 			logging_level = config.getint( 'Misc', 'logging' )
@@ -115,10 +325,16 @@ def main():
 		model_path = args.model_path
 	if args.data_path is not None:
 		data_path = args.data_path
+	if args.mallet_import is not None:
+		mallet_import = args.mallet_import
+	if args.mallet_beta is not None:
+		mallet_beta = args.mallet_beta
+	if args.mallet_export_dense is not None:
+		mallet_export_dense = args.mallet_export_dense
 	if args.logging is not None:
 		logging_level = args.logging
 	
-	ImportMallet( logging_level ).execute( model_library, model_path, data_path )
+	ImportMallet( logging_level ).execute( model_library, model_path, data_path, mallet_import, mallet_beta, mallet_export_dense )
 
 if __name__ == '__main__':
 	main()
\ No newline at end of file
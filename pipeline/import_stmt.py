@@ -2,13 +2,18 @@
 # -*- coding: utf-8 -*-
 
 import sys
+import csv
 import argparse
 import ConfigParser
 import logging
 
-from utf8_utils import UnicodeReader
 from api_utils import ModelAPI
 
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
 class ImportStmt( object ):
 	
 	"""
@@ -22,6 +27,9 @@ class ImportStmt( object ):
 	TOPIC_TERM = 'topic-term-distributions.csv'
 	DOCUMENT_TOPIC = 'document-topic-distributions.csv'
 	
+	# Number of rows of document-topic distributions to convert to floats at a time
+	CHUNK_SIZE = 4096
+	
 	def __init__( self, logging_level ):
 		self.logger = logging.getLogger( 'ImportStmt' )
 		self.logger.setLevel( logging_level )
@@ -57,16 +65,13 @@ class ImportStmt( object ):
 		self.model.document_count = len(self.model.document_index)
 		
 		self.logger.info( 'Reading "%s" from STMT output...', ImportStmt.TOPIC_TERM )
-		self.topic_term_counts = self.readCsvAsMatrixStr( model_path, ImportStmt.TOPIC_TERM )
-		
-		self.logger.info( 'Reading "%s" from STMT output...', ImportStmt.DOCUMENT_TOPIC )
-		self.document_topic_counts = self.readCsvAsMatrixStr( model_path, ImportStmt.DOCUMENT_TOPIC )
+		self.topic_term_counts = self.readTopicTermMatrix( model_path, ImportStmt.TOPIC_TERM )
 		
 		self.logger.info( 'Extracting term-topic matrix...' )
 		self.extractTermTopicMatrix()
 		
-		self.logger.info( 'Extracting document-topic matrix...' )
-		self.extractDocumentTopicMatrix()
+		self.logger.info( 'Reading "%s" from STMT output...', ImportStmt.DOCUMENT_TOPIC )
+		self.extractDocumentTopicMatrix( model_path, ImportStmt.DOCUMENT_TOPIC )
 		
 		self.logger.info( 'Writing data to disk...' )
 		self.model.write()
@@ -78,28 +83,57 @@ class ImportStmt( object ):
 			data = f.read().decode( 'utf-8' ).splitlines()
 		return data
 	
-	# Need for STMT, which generates a mixed-string-float document-topic-distributions.csv file
-	def readCsvAsMatrixStr( self, model_path, filename ):
+	def readTopicTermMatrix( self, model_path, filename ):
 		"""
-		Return a matrix (list of list) of string values.
-		Each row corresponds to a line of the input file.
-		Each cell (in a row) corresponds to a comma-separated value (in each line).
+		Return the topic-term distributions (one line of comma-separated floats per topic) as a topics-by-terms matrix.
+		The file is parsed one line at a time, directly into an ndarray if numpy is available.
 		"""
-		data = []
 		filename = '{}/{}'.format( model_path, filename )
+		if numpy is not None:
+			matrix = numpy.empty( ( self.model.topic_count, self.model.term_count ), dtype = numpy.float64 )
+		else:
+			matrix = []
+		topicCount = 0
 		with open( filename, 'r' ) as f:
-			lines = UnicodeReader( f, delimiter = ',' )
-			data = [ d for d in lines ]
-		return data
+			for line in f:
+				if len( line.strip() ) == 0:
+					continue
+				assert topicCount < self.model.topic_count
+				if numpy is not None:
+					row = numpy.fromstring( line, dtype = numpy.float64, sep = ',' )
+					assert len( row ) == self.model.term_count
+					matrix[ topicCount ] = row
+				else:
+					row = map( float, line.split( ',' ) )
+					assert len( row ) == self.model.term_count
+					matrix.append( row )
+				topicCount += 1
+		assert topicCount == self.model.topic_count
+		return matrix
 	
-	def extractDocumentTopicMatrix( self ):
+	def extractDocumentTopicMatrix( self, model_path, filename ):
 		"""
 		Extract document-topic matrix.
 		Probability distributions are stored from the 2nd column onward in the document-topic distributions.
+		Rows are converted to floats in chunks of CHUNK_SIZE documents if numpy is available.
 		"""
-		matrix = []
-		for line in self.document_topic_counts:
-			matrix.append( map( float, line[1:self.model.topic_count+1] ) )
+		topicCount = self.model.topic_count
+		filename = '{}/{}'.format( model_path, filename )
+		with open( filename, 'r' ) as f:
+			lines = ( line[1:topicCount+1] for line in csv.reader( f, delimiter = ',' ) if len( line ) > 0 )
+			if numpy is not None:
+				chunks = []
+				chunk = []
+				for line in lines:
+					chunk.append( line )
+					if len( chunk ) == ImportStmt.CHUNK_SIZE:
+						chunks.append( numpy.array( chunk, dtype = numpy.float64 ) )
+						chunk = []
+				if len( chunk ) > 0 or len( chunks ) == 0:
+					chunks.append( numpy.array( chunk, dtype = numpy.float64 ).reshape( len( chunk ), topicCount ) )
+				matrix = numpy.concatenate( chunks )
+			else:
+				matrix = [ map( float, line ) for line in lines ]
 		self.model.document_topic_matrix = matrix
 	
 	def extractTermTopicMatrix( self ):
@@ -108,11 +142,12 @@ class ImportStmt( object ):
 		Transpose the input topic-term distributions.
 		Ensure all values are greater than or equal to 0.
 		"""
-		matrix = [ [0] * self.model.topic_count ] * self.model.term_count
-		for j, line in enumerate( self.topic_term_counts ):
-			for i, value in enumerate(line):
-				matrix[i][j] = max( 0, float(value) )
-		self.model.term_topic_matrix = matrix
+		if numpy is not None:
+			matrix = numpy.maximum( self.topic_term_counts, 0.0, out = self.topic_term_counts )
+			self.model.term_topic_matrix = numpy.ascontiguousarray( matrix.T )
+		else:
+			self.model.term_topic_matrix = [ [ max( 0.0, value ) for value in column ] for column in zip( *self.topic_term_counts ) ]
+		self.topic_term_counts = None
 
 def main():
 	parser = argparse.ArgumentParser( description = 'Import results from STMT (Stanford Topic-Modeling Toolbox) into Termite.' )
@@ -5,9 +5,19 @@ import json
 import os
 from utf8_utils import UnicodeReader, UnicodeWriter
 
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
 def CheckAndMakeDirs( path ):
 	if not os.path.exists( path ):
-		os.makedirs( path )
+		try:
+			os.makedirs( path )
+		except OSError:
+			# Another process may have created the folder in the meantime
+			if not os.path.isdir( path ):
+				raise
 
 def ReadAsList( filename ):
 	"""
@@ -53,6 +63,20 @@ def ReadAsSparseMatrix( filename ):
 			matrix[ (aKey, bKey) ] = float( value )
 	return matrix
 
+def ReadAsBinaryArray( filename, dtype, shape = None ):
+	"""
+	Memory-map a flat binary file of fixed-width values (read-only, without copying).
+	Optionally reshape the values into an array of the given shape.
+	Requires numpy.
+	"""
+	if os.path.getsize( filename ) == 0:
+		data = numpy.zeros( 0, dtype = dtype )
+	else:
+		data = numpy.memmap( filename, dtype = dtype, mode = 'r' )
+	if shape is not None:
+		data = data.reshape( shape )
+	return data
+
 def ReadAsJson( filename ):
 	"""
 	Expect a dict of values.
@@ -103,6 +127,14 @@ def WriteAsSparseMatrix( matrix, filename ):
 		for ( aKey, bKey ) in sortedKeys:
 			writer.writerow( [ aKey, bKey, str( matrix[ (aKey, bKey) ] ) ] )
 
+def WriteAsBinaryArray( data, filename, dtype ):
+	"""
+	Expect an array (or array-like) of values.
+	Write values to disk in row-major order, as a flat binary file of the given fixed-width type.
+	Requires numpy.
+	"""
+	numpy.ascontiguousarray( data, dtype = dtype ).tofile( filename )
+
 def WriteAsJson( data, filename ):
 	"""
 	Expect a dict of values.
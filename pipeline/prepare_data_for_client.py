@@ -57,6 +57,9 @@ class PrepareDataForClient( object ):
 		self.saliency.read()
 		self.seriation.read()
 
+		self.logger.info( 'Extracting submatrix of seriated terms...' )
+		self.extractSubmatrix()
+		
 		self.logger.info( 'Preparing parameters for seriated matrix...' )
 		self.prepareSeriatedParameters()
 		
@@ -69,25 +72,24 @@ class PrepareDataForClient( object ):
 		self.logger.info( 'Writing data to disk...' )
 		self.client.write()
 
-	def prepareSeriatedParameters( self ):
-		topic_index = self.model.topic_index
-		term_index = self.model.term_index
-		term_topic_matrix = self.model.term_topic_matrix
-		term_ordering = self.seriation.term_ordering
-		term_topic_submatrix = []
-		term_subindex = []
-		for term in term_ordering:
-			if term in term_index:
-				index = term_index.index( term )
-				term_topic_submatrix.append( term_topic_matrix[ index ] )
-				term_subindex.append( term )
+	def extractSubmatrix( self ):
+		"""Extract the rows of the term-topic matrix for the seriated terms (in seriated order), shared by all outputs."""
+		term_rows = { term : index for index, term in enumerate( self.model.term_index ) }
+		rows = []
+		self.term_subindex = []
+		for term in self.seriation.term_ordering:
+			if term in term_rows:
+				rows.append( term_rows[ term ] )
+				self.term_subindex.append( term )
 			else:
 				self.logger.info( 'ERROR: Term (%s) does not appear in the list of seriated terms', term )
-
+		self.term_topic_submatrix = self.model.getSubmatrix( rows )
+	
+	def prepareSeriatedParameters( self ):
 		self.client.seriated_parameters = {
-			'termIndex' : term_subindex,
-			'topicIndex' : topic_index,
-			'matrix' : term_topic_submatrix
+			'termIndex' : self.term_subindex,
+			'topicIndex' : self.model.topic_index,
+			'matrix' : self.term_topic_submatrix
 		}
 	
 	def prepareFilteredParameters( self ):
@@ -104,26 +106,12 @@ class PrepareDataForClient( object ):
 		}
 
 	def prepareGlobalTermFreqs( self ):
-		topic_index = self.model.topic_index
-		term_index = self.model.term_index
-		term_topic_matrix = self.model.term_topic_matrix
-		term_ordering = self.seriation.term_ordering
-		term_topic_submatrix = []
-		term_subindex = []
-		for term in term_ordering:
-			if term in term_index:
-				index = term_index.index( term )
-				term_topic_submatrix.append( term_topic_matrix[ index ] )
-				term_subindex.append( term )
-			else:
-				self.logger.info( 'ERROR: Term (%s) does not appear in the list of seriated terms', term )
-
 		term_freqs = { d['term']: d['frequency'] for d in self.saliency.term_info }
 
 		self.client.global_term_freqs = {
-			'termIndex' : term_subindex,
-			'topicIndex' : topic_index,
-			'matrix' : term_topic_submatrix,
+			'termIndex' : self.term_subindex,
+			'topicIndex' : self.model.topic_index,
+			'matrix' : self.term_topic_submatrix,
 			'termFreqMap' : term_freqs
 		}
 
@@ -6,6 +6,7 @@ import sys
 import argparse
 import logging
 import ConfigParser
+import multiprocessing
 from api_utils import DocumentsAPI, TokensAPI
 
 class Tokenize( object ):
@@ -13,11 +14,26 @@ class Tokenize( object ):
 	"""
 	Takes in the input corpus doc and writes it out as a list of tokens.
 	
-	Currently, supports only single document corpus with one document per line of format:
+	Supports a corpus file with one document per line of format:
 		doc_id<tab>document_content
 	(Two fields delimited by tab.)
 	
-	Support for multiple files, directory(ies), and Lucene considered for future releases.
+	Also supports multiple such files matching a glob pattern ('glob' format), and
+	a directory with one document per file ('folder' format). Compressed files
+	(.gz, .bz2, .xz) are read directly. See DocumentsAPI.
+	
+	Support for Lucene considered for future releases.
+	
+	In streaming mode, documents are read, tokenized, and written out one line
+	at a time, so that memory usage does not grow with the size of the corpus.
+	Documents are written in the same order as they appear in the corpus.
+	
+	With multiple workers, the corpus is split into chunks (byte ranges of
+	uncompressed files, whole compressed files, or groups of files in a folder)
+	that are tokenized in a pool of processes, and the partial outputs are
+	concatenated in corpus order. Each worker also encodes its tokens with its
+	own vocabulary; the partial token stores are then merged without re-reading
+	the tokens file.
 	"""
 	
 	WHITESPACE_TOKENIZATION = r'[^ ]+'
@@ -25,6 +41,7 @@ class Tokenize( object ):
 	ALPHA_TOKENIZATION = r'[A-Za-z_]+'
 	UNICODE_TOKENIZATION = r'[\w]+'
 	DEFAULT_TOKENIZATION = ALPHA_TOKENIZATION
+	CHUNKS_PER_WORKER = 4
 	
 	def __init__( self, logging_level ):
 		self.logger = logging.getLogger( 'Tokenize' )
@@ -33,7 +50,7 @@ class Tokenize( object ):
 		handler.setLevel( logging_level )
 		self.logger.addHandler( handler )
 	
-	def execute( self, corpus_format, corpus_path, data_path, tokenization ):		
+	def execute( self, corpus_format, corpus_path, data_path, tokenization, streaming = False, workers = None ):
 		assert corpus_format is not None
 		assert corpus_path is not None
 		assert data_path is not None
@@ -53,19 +70,28 @@ class Tokenize( object ):
 		self.logger.info( '    corpus_path = %s (%s)', corpus_path, corpus_format                            )
 		self.logger.info( '    data_path = %s', data_path                                                    )
 		self.logger.info( '    tokenization = %s', tokenization                                              )
+		self.logger.info( '    streaming = %s', streaming                                                    )
+		self.logger.info( '    workers = %s', workers                                                        )
 		
 		self.logger.info( 'Connecting to data...' )
 		self.documents = DocumentsAPI( corpus_format, corpus_path )
 		self.tokens = TokensAPI( data_path )
 		
-		self.logger.info( 'Reading from disk...' )
-		self.documents.read()
-		
-		self.logger.info( 'Tokenizing...' )
-		self.TokenizeDocuments( re.compile( tokenization, re.UNICODE ) )
-		
-		self.logger.info( 'Writing to disk...' )
-		self.tokens.write()
+		if workers is not None and workers > 1:
+			self.logger.info( 'Tokenizing and writing to disk using %d workers...', workers )
+			self.TokenizeInParallel( corpus_format, corpus_path, data_path, tokenization, workers )
+		elif streaming:
+			self.logger.info( 'Tokenizing and writing to disk...' )
+			self.tokens.write( self.TokenizeDocumentStream( re.compile( tokenization, re.UNICODE ) ) )
+		else:
+			self.logger.info( 'Reading from disk...' )
+			self.documents.read()
+			
+			self.logger.info( 'Tokenizing...' )
+			self.TokenizeDocuments( re.compile( tokenization, re.UNICODE ) )
+			
+			self.logger.info( 'Writing to disk...' )
+			self.tokens.write()
 		
 		self.logger.info( '--------------------------------------------------------------------------------' )
 	
@@ -74,12 +100,37 @@ class Tokenize( object ):
 			docTokens = self.TokenizeDocument( docContent, tokenizer )
 			self.tokens.data[ docID ] = docTokens
 	
-	def TokenizeDocument( self, text, tokenizer ):
+	def TokenizeDocumentStream( self, tokenizer ):
+		for docID, docContent in self.documents.iterate():
+			yield docID, self.TokenizeDocument( docContent, tokenizer )
+	
+	def TokenizeInParallel( self, corpus_format, corpus_path, data_path, tokenization, workers ):
+		chunks = self.documents.getChunks( workers * Tokenize.CHUNKS_PER_WORKER )
+		tasks = [ ( corpus_format, corpus_path, data_path, tokenization, chunk, index ) for index, chunk in enumerate( chunks ) ]
+		pool = multiprocessing.Pool( workers )
+		try:
+			parts = pool.map( TokenizeChunk, tasks )
+		finally:
+			pool.close()
+			pool.join()
+		self.tokens.merge( parts )
+	
+	@staticmethod
+	def TokenizeDocument( text, tokenizer ):
 		tokens = []
 		for token in re.findall( tokenizer, text ):
 			tokens.append( token.lower() )
 		return tokens
 
+def TokenizeChunk( task ):
+	"""Tokenize one chunk of the corpus into a partial tokens file and token store. Runs in a worker process."""
+	( corpus_format, corpus_path, data_path, tokenization, chunk, index ) = task
+	documents = DocumentsAPI( corpus_format, corpus_path )
+	tokens = TokensAPI( data_path )
+	tokenizer = re.compile( tokenization, re.UNICODE )
+	tokens.write( ( ( docID, Tokenize.TokenizeDocument( docContent, tokenizer ) ) for docID, docContent in documents.iterate( chunk ) ), index )
+	return index
+
 #-------------------------------------------------------------------------------#
 
 def main():
@@ -89,6 +140,8 @@ def main():
 	parser.add_argument( '--corpus-path'  , type = str, dest = 'corpus_path'  , help = 'Override corpus path.'                )
 	parser.add_argument( '--tokenization' , type = str, dest = 'tokenization' , help = 'Override tokenization regex pattern.' )
 	parser.add_argument( '--data-path'    , type = str, dest = 'data_path'    , help = 'Override data path.'                  )
+	parser.add_argument( '--streaming'    , action = 'store_true', dest = 'streaming', default = None, help = 'Tokenize one document at a time, with bounded memory usage.' )
+	parser.add_argument( '--workers'      , type = int, dest = 'workers'      , help = 'Number of worker processes.'          )
 	parser.add_argument( '--logging'      , type = int, dest = 'logging'      , help = 'Override logging level.'              )
 	args = parser.parse_args()
 	
@@ -97,6 +150,8 @@ def main():
 	corpus_path = None
 	tokenization = None
 	data_path = None
+	streaming = False
+	workers = None
 	logging_level = 20
 	
 	# Read in default values from the configuration file
@@ -109,8 +164,12 @@ def main():
 			corpus_path = config.get( 'Corpus', 'path' )
 		if config.has_section( 'Corpus' ) and config.has_option( 'Corpus', 'tokenization' ):
 			tokenization = config.get( 'Corpus', 'tokenization' )
+		if config.has_section( 'Corpus' ) and config.has_option( 'Corpus', 'streaming' ):
+			streaming = config.getboolean( 'Corpus', 'streaming' )
 		if config.has_section( 'Termite' ) and config.has_option( 'Termite', 'path' ):
 			data_path = config.get( 'Termite', 'path' )
+		if config.has_section( 'Misc' ) and config.has_option( 'Misc', 'workers' ):
+			workers = config.getint( 'Misc', 'workers' )
 		if config.has_section( 'Misc' ) and config.has_option( 'Misc', 'logging' ):
 			logging_level = config.getint( 'Misc', 'logging' )
 	
@@ -123,10 +182,14 @@ def main():
 		tokenization = args.tokenization
 	if args.data_path is not None:
 		data_path = args.data_path
+	if args.streaming is not None:
+		streaming = args.streaming
+	if args.workers is not None:
+		workers = args.workers
 	if args.logging is not None:
 		logging_level = args.logging
 	
-	Tokenize( logging_level ).execute( corpus_format, corpus_path, data_path, tokenization )
+	Tokenize( logging_level ).execute( corpus_format, corpus_path, data_path, tokenization, streaming, workers )
 
 if __name__ == '__main__':
 	main()
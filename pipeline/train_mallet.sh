@@ -40,6 +40,7 @@ $MALLET/bin/mallet train-topics \
 	--output-topic-keys $OUTPUT/output-topic-keys.txt \
 	--topic-word-weights-file $OUTPUT/topic-word-weights.txt \
 	--word-topic-counts-file $OUTPUT/word-topic-counts.txt \
+	--output-doc-topics $OUTPUT/output-doc-topics.txt \
 	--num-topics $TOPICS
 
 echo "--------------------------------------------------------------------------------"